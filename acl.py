@@ -0,0 +1,109 @@
+from sqlalchemy import and_, delete, exists, insert, select, true, union
+
+from app import db
+from models import File, FileAccess, FileGrant, GroupMember
+
+# File visibility for client users.
+#
+# Grants (per user or per group) are the source of truth. FileAccess holds
+# the resolved (user, file) pairs so that listing, search and downloads are
+# a single indexed join instead of a walk over grants and memberships. Every
+# function that changes grants or memberships refreshes the affected pairs
+# in the same session; callers commit.
+
+
+def visible_files(user):
+    """Query of the files ``user`` may see. Ops users see everything."""
+    if user.role == 'ops':
+        return File.query
+    return File.query.join(FileAccess, FileAccess.file_id == File.id).filter(FileAccess.user_id == user.id)
+
+
+def _scope(user_col, file_col, user_ids, file_ids):
+    conditions = []
+    if user_ids is not None:
+        conditions.append(user_col.in_(user_ids))
+    if file_ids is not None:
+        conditions.append(file_col.in_(file_ids))
+    return and_(true(), *conditions)
+
+
+def refresh_access(user_ids=None, file_ids=None):
+    """Recompute FileAccess for the given users and/or files.
+
+    ``user_ids`` and ``file_ids`` may be lists or subqueries; ``None``
+    means no restriction on that side.
+    """
+    direct = exists().where(
+        FileGrant.file_id == FileAccess.file_id,
+        FileGrant.user_id == FileAccess.user_id
+    )
+    via_group = exists().where(
+        FileGrant.file_id == FileAccess.file_id,
+        FileGrant.group_id == GroupMember.group_id,
+        GroupMember.user_id == FileAccess.user_id
+    )
+    db.session.execute(
+        delete(FileAccess)
+        .where(_scope(FileAccess.user_id, FileAccess.file_id, user_ids, file_ids), ~direct, ~via_group)
+        .execution_options(synchronize_session=False)
+    )
+
+    effective = union(
+        select(FileGrant.user_id.label('user_id'), FileGrant.file_id.label('file_id'))
+        .where(FileGrant.user_id.isnot(None), _scope(FileGrant.user_id, FileGrant.file_id, user_ids, file_ids)),
+        select(GroupMember.user_id.label('user_id'), FileGrant.file_id.label('file_id'))
+        .join(GroupMember, GroupMember.group_id == FileGrant.group_id)
+        .where(_scope(GroupMember.user_id, FileGrant.file_id, user_ids, file_ids))
+    ).subquery()
+    missing = select(effective.c.user_id, effective.c.file_id).where(~exists().where(
+        FileAccess.user_id == effective.c.user_id,
+        FileAccess.file_id == effective.c.file_id
+    ))
+    db.session.execute(insert(FileAccess).from_select(['user_id', 'file_id'], missing))
+
+
+def grant(file_id, user_ids=(), group_ids=()):
+    existing = FileGrant.query.filter_by(file_id=file_id).all()
+    granted_users = {g.user_id for g in existing if g.user_id is not None}
+    granted_groups = {g.group_id for g in existing if g.group_id is not None}
+
+    for user_id in set(user_ids) - granted_users:
+        db.session.add(FileGrant(file_id=file_id, user_id=user_id))
+    for group_id in set(group_ids) - granted_groups:
+        db.session.add(FileGrant(file_id=file_id, group_id=group_id))
+    db.session.flush()
+    refresh_access(file_ids=[file_id])
+
+
+def revoke(file_id, user_ids=(), group_ids=()):
+    db.session.execute(
+        delete(FileGrant)
+        .where(FileGrant.file_id == file_id, FileGrant.user_id.in_(list(user_ids)))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(FileGrant)
+        .where(FileGrant.file_id == file_id, FileGrant.group_id.in_(list(group_ids)))
+        .execution_options(synchronize_session=False)
+    )
+    refresh_access(file_ids=[file_id])
+
+
+def _group_files(group_id):
+    return select(FileGrant.file_id).where(FileGrant.group_id == group_id)
+
+
+def add_member(group_id, user_id):
+    if db.session.get(GroupMember, (group_id, user_id)) is None:
+        db.session.add(GroupMember(group_id=group_id, user_id=user_id))
+        db.session.flush()
+    refresh_access(user_ids=[user_id], file_ids=_group_files(group_id))
+
+
+def remove_member(group_id, user_id):
+    member = db.session.get(GroupMember, (group_id, user_id))
+    if member is not None:
+        db.session.delete(member)
+        db.session.flush()
+    refresh_access(user_ids=[user_id], file_ids=_group_files(group_id))
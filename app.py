@@ -5,13 +5,17 @@ from flask_mail import Mail
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
 from dotenv import load_dotenv
+from request_log import init_request_logging
+from json_provider import FastJSONProvider
 import os
+import socket
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # Get the database URL from environment variable
 database_url = os.getenv('DATABASE_URL')
@@ -24,6 +28,45 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['DOWNLOAD_LINK_KEY'] = os.getenv('DOWNLOAD_LINK_KEY')  # Fernet key shared by all workers and nodes
+app.config['ARCHIVE_MAX_FILES'] = int(os.getenv('ARCHIVE_MAX_FILES', 100))
+app.config['ARCHIVE_CHUNK_SIZE'] = 64 * 1024  # 64KB read size when streaming archives
+
+# Storage quota and lifecycle configuration
+app.config['STORAGE_QUOTA_BYTES'] = int(os.getenv('STORAGE_QUOTA_BYTES', 0)) or None  # per uploader, unset = unlimited
+app.config['COLD_STORAGE_FOLDER'] = os.getenv('COLD_STORAGE_FOLDER', 'uploads_cold')
+app.config['COLD_AFTER_DAYS'] = int(os.getenv('COLD_AFTER_DAYS', 30))
+app.config['ACCESS_FLUSH_INTERVAL'] = 30  # seconds between batched last_accessed_at writes
+
+# Change feed configuration
+app.config['CHANGE_FEED_PAGE_SIZE'] = 500
+app.config['CHANGE_FEED_MAX_WAIT'] = 25  # seconds; keep below the gunicorn worker timeout
+app.config['CHANGE_FEED_POLL_INTERVAL'] = 1.0
+
+# Cluster configuration; CLUSTER_PEERS is "name=url,name=url" and includes this node
+app.config['NODE_ID'] = os.getenv('NODE_ID', socket.gethostname())
+app.config['CLUSTER_PEERS'] = dict(peer.split('=', 1) for peer in os.getenv('CLUSTER_PEERS', '').split(',') if peer)
+app.config['CLUSTER_SECRET'] = os.getenv('CLUSTER_SECRET', '')
+app.config['CLUSTER_PEER_TIMEOUT'] = 10  # seconds
+app.config['CLUSTER_REPLICATION_RETRIES'] = 5
+app.config['CLUSTER_SIGNATURE_MAX_AGE'] = 60  # seconds of clock skew and transit allowed
+
+# Token revocation configuration
+app.config['REVOCATION_BLOOM_FILE'] = os.getenv('REVOCATION_BLOOM_FILE', os.path.join(app.instance_path, 'revoked_tokens.bloom'))
+app.config['REVOCATION_BLOOM_CAPACITY'] = int(os.getenv('REVOCATION_BLOOM_CAPACITY', 100000))
+app.config['REVOCATION_BLOOM_ERROR_RATE'] = 0.001
+app.config['REVOCATION_SYNC_INTERVAL'] = 5  # seconds between pulls of revocations made elsewhere
+app.config['REVOCATION_SYNC_OVERLAP'] = 300  # seconds each pull reaches back for late commits and clock skew
+
+# Request logging configuration
+app.config['REQUEST_LOG_ENABLED'] = os.getenv('REQUEST_LOG_ENABLED', 'True') == 'True'
+app.config['REQUEST_LOG_FILE'] = os.getenv('REQUEST_LOG_FILE')  # stderr when unset
+app.config['REQUEST_LOG_QUEUE_SIZE'] = 10000
+app.config['REQUEST_LOG_SLOW_MS'] = int(os.getenv('REQUEST_LOG_SLOW_MS', 1000))
+app.config['REQUEST_LOG_SAMPLE_RATES'] = {
+    'download_file': float(os.getenv('DOWNLOAD_LOG_SAMPLE_RATE', 0.1)),
+    'download_archive': float(os.getenv('DOWNLOAD_LOG_SAMPLE_RATE', 0.1))
+}
 
 # Email configuration
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
@@ -38,6 +81,7 @@ jwt = JWTManager(app)
 mail = Mail(app)
 bcrypt = Bcrypt(app)
 migrate = Migrate(app, db)
+init_request_logging(app)
 
 # Create uploads folder if it doesn't exist
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
@@ -0,0 +1,273 @@
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+# Streaming ZIP writer for bulk downloads.
+#
+# Entries are stored uncompressed (the office formats we serve are already
+# zip containers) and are read from disk in fixed-size chunks, so memory use
+# does not depend on the archive size. Every header length is known before
+# any file is read, which lets us send Content-Length up front and serve
+# byte ranges for resumed downloads.
+#
+# A CRC is only needed for the data descriptor right after an entry and for the
+# central directory. Each process caches CRCs by (path, size, mtime), so a
+# resumed download seeks straight to the entry that holds its first byte and
+# reads nothing it does not send. The exception is a range that reaches the
+# central directory when some CRCs are not cached yet.
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_END_LOCATOR = struct.Struct('<IIQI')
+
+# Bit 3: CRC follows the data in a descriptor. Bit 11: names are UTF-8.
+_FLAGS = 0x08 | 0x800
+_VERSION = 20
+_VERSION_ZIP64 = 45
+_EXTERNAL_ATTR = 0o100644 << 16
+
+CRC_CACHE_SIZE = 4096
+
+
+class _CRCCache:
+    """Bounded LRU of file CRCs, keyed by (path, size, mtime_ns).
+
+    Entries without an mtime have no key and are never cached.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.crcs = OrderedDict()
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            crc = self.crcs.get(key)
+            if crc is not None:
+                self.crcs.move_to_end(key)
+            return crc
+
+    def put(self, key, crc):
+        if key is None:
+            return
+        with self.lock:
+            self.crcs[key] = crc
+            self.crcs.move_to_end(key)
+            while len(self.crcs) > self.capacity:
+                self.crcs.popitem(last=False)
+
+
+crc_cache = _CRCCache(CRC_CACHE_SIZE)
+
+
+class ArchiveEntry:
+    def __init__(self, path, name, size, modified, mtime_ns=None):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.modified = modified
+        self.mtime_ns = mtime_ns
+        self.offset = 0
+
+    @property
+    def cache_key(self):
+        if self.mtime_ns is None:
+            return None
+        return (self.path, self.size, self.mtime_ns)
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT
+
+    @property
+    def dos_time(self):
+        dt = self.modified
+        return (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+
+    @property
+    def dos_date(self):
+        dt = self.modified
+        return (max(dt.year, 1980) - 1980) << 9 | (dt.month << 5) | dt.day
+
+
+def _local_header(entry):
+    name = entry.name.encode('utf-8')
+    if entry.zip64:
+        extra = struct.pack('<HHQQ', 0x0001, 16, entry.size, entry.size)
+        size = ZIP64_LIMIT
+        version = _VERSION_ZIP64
+    else:
+        extra = b''
+        size = entry.size
+        version = _VERSION
+    return _LOCAL_HEADER.pack(
+        0x04034b50, version, _FLAGS, 0, entry.dos_time, entry.dos_date,
+        0, size, size, len(name), len(extra)
+    ) + name + extra
+
+
+def _data_descriptor(entry, crc):
+    if entry.zip64:
+        return struct.pack('<IIQQ', 0x08074b50, crc, entry.size, entry.size)
+    return struct.pack('<IIII', 0x08074b50, crc, entry.size, entry.size)
+
+
+def _central_header(entry, crc):
+    name = entry.name.encode('utf-8')
+    fields = []
+    size = entry.size
+    offset = entry.offset
+    if entry.zip64:
+        fields += [entry.size, entry.size]
+        size = ZIP64_LIMIT
+    if entry.offset >= ZIP64_LIMIT:
+        fields.append(entry.offset)
+        offset = ZIP64_LIMIT
+    extra = b''
+    if fields:
+        extra = struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields)
+    version = _VERSION_ZIP64 if fields else _VERSION
+    return _CENTRAL_HEADER.pack(
+        0x02014b50, version, version, _FLAGS, 0, entry.dos_time, entry.dos_date,
+        crc, size, size, len(name), len(extra), 0, 0, 0, _EXTERNAL_ATTR, offset
+    ) + name + extra
+
+
+def _end_records(count, cd_offset, cd_size):
+    records = b''
+    if count >= ZIP_FILECOUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_offset = cd_offset + cd_size
+        records += _ZIP64_END_RECORD.pack(
+            0x06064b50, _ZIP64_END_RECORD.size - 12, _VERSION_ZIP64, _VERSION_ZIP64,
+            0, 0, count, count, cd_size, cd_offset
+        )
+        records += _ZIP64_END_LOCATOR.pack(0x07064b50, 0, zip64_offset, 1)
+        count = min(count, ZIP_FILECOUNT_LIMIT)
+        cd_offset = min(cd_offset, ZIP64_LIMIT)
+        cd_size = min(cd_size, ZIP64_LIMIT)
+    return records + _END_RECORD.pack(0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+
+def unique_names(names):
+    """Rename duplicates to ``name (2).ext`` so every entry is extractable."""
+    seen = set()
+    result = []
+    for name in names:
+        candidate = name
+        stem, dot, ext = name.rpartition('.')
+        if not dot:
+            stem, ext = name, ''
+        counter = 2
+        while candidate in seen:
+            candidate = f'{stem} ({counter}){dot}{ext}'
+            counter += 1
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+
+class ZipStream:
+    def __init__(self, entries, chunk_size=64 * 1024):
+        self.entries = entries
+        self.chunk_size = chunk_size
+
+        # Lay out the archive once so the total size is known up front
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            offset += len(_local_header(entry)) + entry.size + len(_data_descriptor(entry, 0))
+        self.cd_offset = offset
+        self.cd_size = sum(len(_central_header(entry, 0)) for entry in entries)
+        self.size = offset + self.cd_size + len(_end_records(len(entries), self.cd_offset, self.cd_size))
+
+    def _read(self, entry, start, stop):
+        """Yield ``entry``'s data in ``[start, stop)``, checking the file did not shrink."""
+        remaining = stop - start
+        with open(entry.path, 'rb') as f:
+            f.seek(start)
+            while remaining:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f'{entry.path} shrank while being archived')
+                remaining -= len(chunk)
+                yield chunk
+
+    def crc(self, entry):
+        crc = crc_cache.get(entry.cache_key)
+        if crc is None:
+            crc = 0
+            for chunk in self._read(entry, 0, entry.size):
+                crc = zlib.crc32(chunk, crc)
+            crc_cache.put(entry.cache_key, crc)
+        return crc
+
+    def iter_range(self, start=0, stop=None):
+        """Yield archive bytes in ``[start, stop)``.
+
+        Entries that end before ``start`` are skipped without opening them.
+        """
+        if stop is None:
+            stop = self.size
+
+        def clip(data, offset):
+            return data[max(start - offset, 0):max(stop - offset, 0)]
+
+        for entry in self.entries:
+            header = _local_header(entry)
+            data_offset = entry.offset + len(header)
+            descriptor_offset = data_offset + entry.size
+            descriptor_size = len(_data_descriptor(entry, 0))
+            if entry.offset >= stop:
+                return
+            if descriptor_offset + descriptor_size <= start:
+                continue
+
+            if start < data_offset:
+                yield clip(header, entry.offset)
+            read_start = max(start - data_offset, 0)
+            read_stop = min(stop - data_offset, entry.size)
+            crc = crc_cache.get(entry.cache_key)
+            if read_start == 0 and read_stop == entry.size and crc is None:
+                # Reading the whole entry anyway, so compute its CRC on the way
+                crc = 0
+                for chunk in self._read(entry, 0, entry.size):
+                    crc = zlib.crc32(chunk, crc)
+                    yield chunk
+                crc_cache.put(entry.cache_key, crc)
+            elif read_start < read_stop:
+                yield from self._read(entry, read_start, read_stop)
+            if stop > descriptor_offset:
+                if crc is None:
+                    crc = self.crc(entry)
+                yield clip(_data_descriptor(entry, crc), descriptor_offset)
+
+        if stop > self.cd_offset:
+            directory = b''.join(_central_header(entry, self.crc(entry)) for entry in self.entries)
+            directory += _end_records(len(self.entries), self.cd_offset, self.cd_size)
+            yield clip(directory, self.cd_offset)
+
+    def __iter__(self):
+        return self.iter_range()
+
+
+def build_entries(files, path_for):
+    """Map ``File`` rows to archive entries, checking each one is on disk.
+
+    ``path_for`` returns the on-disk path of a row, wherever its tier lives.
+    """
+    names = unique_names([file.original_filename for file in files])
+    entries = []
+    for file, name in zip(files, names):
+        path = path_for(file)
+        stat = os.stat(path)
+        entries.append(ArchiveEntry(path, name, stat.st_size, file.created_at, stat.st_mtime_ns))
+    return entries
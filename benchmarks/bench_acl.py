@@ -0,0 +1,105 @@
+"""Listing latency benchmark for the file access tables.
+
+Seeds users and files in batches (default 100k users by 1M files, each file
+shared with a few random users) and, after every batch, times the client
+listing query for a sample of users. Latency should stay flat as the
+catalogue grows, since listing is an indexed join on FileAccess.
+
+    python benchmarks/bench_acl.py --users 100000 --files 1000000
+
+Uses BENCH_DATABASE_URL when set, otherwise a throwaway SQLite file. It never
+reads DATABASE_URL: the benchmark recreates every table when it starts and
+drops them all again when it finishes, even if it fails.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Override DATABASE_URL (and any .env value) so the app never opens the real database
+os.environ['DATABASE_URL'] = (os.getenv('BENCH_DATABASE_URL')
+                              or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_acl.db'))
+
+from sqlalchemy import insert
+
+from app import app, db
+from models import User, File, FileAccess
+from acl import visible_files
+
+
+def seed_users(count):
+    rows = [{'id': i, 'email': f'user{i}@example.com', 'password': 'x', 'role': 'client', 'is_verified': True}
+            for i in range(1, count + 1)]
+    db.session.execute(insert(User), rows)
+    db.session.commit()
+
+
+def seed_files(start, stop, users, shares, rng):
+    files = []
+    access = []
+    for i in range(start, stop):
+        files.append({
+            'id': i, 'filename': f'{i}_file.docx', 'original_filename': f'file{i}.docx',
+            'file_type': 'docx', 'uploaded_by': 1, 'download_token': f'token-{i}'
+        })
+        for user_id in rng.sample(range(1, users + 1), shares):
+            access.append({'user_id': user_id, 'file_id': i})
+    db.session.execute(insert(File), files)
+    db.session.execute(insert(FileAccess), access)
+    db.session.commit()
+
+
+def time_listing(sample, repeat):
+    timings = []
+    for user in sample:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = visible_files(user).all()
+            timings.append(time.perf_counter() - started)
+            db.session.expunge_all()
+    return statistics.median(timings) * 1000, max(timings) * 1000, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--files', type=int, default=1_000_000)
+    parser.add_argument('--shares', type=int, default=3, help='users each file is shared with')
+    parser.add_argument('--steps', type=int, default=5, help='number of growth steps to time')
+    parser.add_argument('--sample', type=int, default=20, help='users timed per step')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    batch = 50_000
+    checkpoints = {args.files * (step + 1) // args.steps for step in range(args.steps)}
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        try:
+            seed_users(args.users)
+            sample = [SimpleNamespace(id=user_id, role='client')
+                      for user_id in rng.sample(range(1, args.users + 1), args.sample)]
+
+            print(f'{"files":>10} {"access rows":>12} {"median ms":>10} {"max ms":>8}')
+            seeded = 0
+            for checkpoint in sorted(checkpoints):
+                while seeded < checkpoint:
+                    stop = min(seeded + batch, checkpoint)
+                    seed_files(seeded + 1, stop + 1, args.users, args.shares, rng)
+                    seeded = stop
+                median, worst, _ = time_listing(sample, args.repeat)
+                print(f'{seeded:>10} {seeded * args.shares:>12} {median:>10.3f} {worst:>8.3f}')
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
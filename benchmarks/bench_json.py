@@ -0,0 +1,106 @@
+"""Serialization throughput for file listing responses.
+
+Compares the old handler path (a dict per ORM object, ``isoformat()`` per
+row, stdlib provider) with FastJSONProvider serializing ``Row`` results
+directly, with orjson and with its stdlib fallback.
+
+    python benchmarks/bench_json.py --rows 10000 100000
+
+Uses BENCH_DATABASE_URL when set, otherwise a throwaway SQLite file. It never
+reads DATABASE_URL: the benchmark recreates every table when it starts and
+drops them all again when it finishes, even if it fails.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Override DATABASE_URL (and any .env value) so the app never opens the real database
+os.environ['DATABASE_URL'] = (os.getenv('BENCH_DATABASE_URL')
+                              or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_json.db'))
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import insert
+
+import json_provider
+from app import app, db
+from models import User, File
+from json_provider import FastJSONProvider
+from routes import FILE_LISTING_COLUMNS
+
+
+def seed(count):
+    db.session.execute(insert(User), [{'id': 1, 'email': 'ops@example.com', 'password': 'x', 'role': 'ops'}])
+    started = datetime(2024, 1, 1)
+    db.session.execute(insert(File), [{
+        'id': i, 'filename': f'{i}_report.docx', 'original_filename': f'report {i}.docx',
+        'file_type': 'docx', 'uploaded_by': 1, 'download_token': f'token-{i}',
+        'created_at': started + timedelta(seconds=i)
+    } for i in range(1, count + 1)])
+    db.session.commit()
+
+
+def stdlib_dicts(limit):
+    files = File.query.limit(limit).all()
+    file_list = [{
+        'id': file.id,
+        'filename': file.original_filename,
+        'type': file.file_type,
+        'uploaded_at': file.created_at.isoformat()
+    } for file in files]
+    return DefaultJSONProvider(app).dumps({'files': file_list})
+
+
+def provider_rows(provider):
+    def run(limit):
+        files = File.query.with_entities(*FILE_LISTING_COLUMNS).limit(limit).all()
+        return provider.dumps({'files': files})
+    return run
+
+
+def best_of(fn, limit, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(limit)
+        timings.append(time.perf_counter() - started)
+        db.session.expunge_all()
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    provider = FastJSONProvider(app)
+    variants = [('dicts + stdlib (before)', stdlib_dicts, None)]
+    if json_provider.orjson is not None:
+        variants.append(('rows + orjson', provider_rows(provider), json_provider.orjson))
+    variants.append(('rows + stdlib fallback', provider_rows(provider), None))
+    orjson = json_provider.orjson
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        try:
+            seed(max(args.rows))
+
+            print(f'{"variant":<26} {"rows":>8} {"ms":>9} {"rows/s":>12}')
+            for limit in args.rows:
+                for name, fn, serializer in variants:
+                    json_provider.orjson = serializer
+                    elapsed = best_of(fn, limit, args.repeat)
+                    print(f'{name:<26} {limit:>8} {elapsed * 1000:>9.1f} {limit / elapsed:>12,.0f}')
+        finally:
+            json_provider.orjson = orjson
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
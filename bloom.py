@@ -0,0 +1,81 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import threading
+
+
+class BloomFilter:
+    """Bloom filter whose bit array lives in a memory-mapped file.
+
+    Every process that opens the same path shares one set of bits, so a key
+    added by one gunicorn worker is visible to the others straight away.
+    Lookups only touch memory. Writers take an exclusive lock so concurrent
+    adds to the same byte are not lost; flock only excludes other processes,
+    so threads in one process also share a mutex.
+    """
+
+    def __init__(self, path, capacity, error_rate):
+        self.path = path
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._lock = threading.Lock()
+        self._state = None
+        self.open()
+
+    def open(self):
+        """Map the file at ``path``, replacing any earlier mapping.
+
+        The new file and mapping are swapped in with one assignment, so a
+        concurrent lookup sees either the old bits or the new ones. The old
+        mapping is never closed here, since a reader may still hold it; it is
+        released with its file once nothing references it.
+        """
+        nbytes = (self.size + 7) // 8
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size != nbytes:
+            # New file, or the filter was resized: start from a blank file
+            # swapped in atomically so other processes never see a torn one
+            os.close(fd)
+            self.reset(self.path, nbytes)
+            fd = os.open(self.path, os.O_RDWR)
+        file = os.fdopen(fd, 'r+b', buffering=0)
+        bits = mmap.mmap(fd, nbytes, mmap.MAP_SHARED)
+        with self._lock:
+            self._state = (file, bits, os.fstat(fd).st_ino)
+
+    @staticmethod
+    def reset(path, nbytes):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.truncate(nbytes)
+        os.replace(tmp_path, path)
+
+    def replaced(self):
+        """True when another process swapped in a new file since we opened ours."""
+        try:
+            return os.stat(self.path).st_ino != self._state[2]
+        except FileNotFoundError:
+            return True
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        with self._lock:
+            file, bits, _ = self._state
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                for position in self._positions(key):
+                    bits[position >> 3] |= 1 << (position & 7)
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def __contains__(self, key):
+        bits = self._state[1]
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
@@ -0,0 +1,84 @@
+import json
+import time
+
+from sqlalchemy import text
+
+from app import app, db
+from models import FileEvent
+
+# Change feed for the file catalogue.
+#
+# Events are added to the caller's session so they commit (or roll back)
+# together with the upload or delete they describe. Consumers read them by
+# offset, optionally waiting for new ones, instead of re-fetching the full
+# file list.
+#
+# Offsets are only safe to resume from if events commit in id order; if
+# event N+1 became visible before N, a consumer would move past N and never
+# see it. Appends therefore take a transaction-scoped lock on PostgreSQL, so
+# ids are handed out and committed one writer at a time. SQLite already
+# serializes writers.
+
+# Arbitrary application-wide key for pg_advisory_xact_lock
+APPEND_LOCK_KEY = 0x66656564
+
+
+def record_event(file, event):
+    """Add an event to the current transaction.
+
+    Call it after the transaction's other writes: the append lock is held
+    until commit, and taking row locks after it could deadlock.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': APPEND_LOCK_KEY})
+    db.session.add(FileEvent(
+        event=event,
+        file_id=file.id,
+        filename=file.original_filename,
+        file_type=file.file_type,
+        uploaded_by=file.uploaded_by
+    ))
+
+
+def serialize_event(event):
+    return {
+        'offset': event.id,
+        'event': event.event,
+        'file_id': event.file_id,
+        'filename': event.filename,
+        'type': event.file_type,
+        'uploaded_by': event.uploaded_by,
+        'at': event.created_at.isoformat()
+    }
+
+
+def fetch_events(since, limit):
+    events = FileEvent.query.filter(FileEvent.id > since).order_by(FileEvent.id).limit(limit).all()
+    return [serialize_event(event) for event in events]
+
+
+def wait_for_events(since, limit, timeout):
+    """Poll for events after ``since`` for up to ``timeout`` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        events = fetch_events(since, limit)
+        # End the read transaction so the next poll sees new commits and the
+        # connection goes back to the pool while we sleep
+        db.session.rollback()
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events
+        time.sleep(min(app.config['CHANGE_FEED_POLL_INTERVAL'], remaining))
+
+
+def stream_events(since, limit, timeout):
+    """Server-Sent Events until ``timeout``; clients reconnect with Last-Event-ID."""
+    deadline = time.monotonic() + timeout
+    yield f"retry: {int(app.config['CHANGE_FEED_POLL_INTERVAL'] * 1000)}\n\n"
+    while True:
+        events = wait_for_events(since, limit, max(deadline - time.monotonic(), 0))
+        for event in events:
+            yield f"id: {event['offset']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            since = event['offset']
+        if time.monotonic() >= deadline:
+            return
@@ -0,0 +1,269 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+import time
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from app import app, db
+from models import File, FileReplica
+from per_process import PerProcess
+from storage import HOT, tier_folder, local_path, tier_of
+
+# Multi-node storage.
+#
+# Every node keeps uploads on its own disk and shares the database. After an
+# upload commits, a background thread pushes the file to each peer over HTTP;
+# the peer stores it and records its own FileReplica row. A node asked for a
+# file it does not hold streams it from a peer that does, so the load
+# balancer needs no node affinity.
+#
+# Peer requests carry an HMAC under CLUSTER_SECRET of the method, path,
+# sending node, a timestamp and the SHA-256 of the body. Receivers reject
+# timestamps outside CLUSTER_SIGNATURE_MAX_AGE and check pushed bytes against
+# the signed digest, so a captured request can neither be replayed later nor
+# reused with a different body.
+
+logger = logging.getLogger('filesharing.cluster')
+
+EMPTY_DIGEST = hashlib.sha256().hexdigest()
+
+
+def node_id():
+    return app.config['NODE_ID']
+
+
+def peers():
+    return {name: url for name, url in app.config['CLUSTER_PEERS'].items() if name != node_id()}
+
+
+def cluster_enabled():
+    return bool(peers())
+
+
+def sign(method, path, node, timestamp, digest):
+    message = '\n'.join([method, path, node, str(timestamp), digest])
+    return hmac.new(app.config['CLUSTER_SECRET'].encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+def signed_headers(method, path, digest=EMPTY_DIGEST):
+    timestamp = int(time.time())
+    return {
+        'X-Cluster-Node': node_id(),
+        'X-Cluster-Timestamp': str(timestamp),
+        'X-Cluster-Content-SHA256': digest,
+        'X-Cluster-Signature': sign(method, path, node_id(), timestamp, digest)
+    }
+
+
+def verify_signature(method, path, headers):
+    """True when ``headers`` carry a fresh signature from a known peer.
+
+    Only the signed digest is checked here; whoever reads a body compares it
+    against ``X-Cluster-Content-SHA256``.
+    """
+    if not app.config['CLUSTER_SECRET']:
+        return False
+    node = headers.get('X-Cluster-Node', '')
+    if node not in app.config['CLUSTER_PEERS']:
+        return False
+    try:
+        timestamp = int(headers.get('X-Cluster-Timestamp', ''))
+    except ValueError:
+        return False
+    if abs(time.time() - timestamp) > app.config['CLUSTER_SIGNATURE_MAX_AGE']:
+        return False
+    expected = sign(method, path, node, timestamp, headers.get('X-Cluster-Content-SHA256', ''))
+    return hmac.compare_digest(headers.get('X-Cluster-Signature', ''), expected)
+
+
+def verify_peer_request(request):
+    return verify_signature(request.method, request.path, request.headers)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    chunk_size = app.config['ARCHIVE_CHUNK_SIZE']
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def peer_request(peer_url, method, path, data=None, headers=None, digest=EMPTY_DIGEST):
+    headers = dict(headers or {})
+    headers.update(signed_headers(method, path, digest))
+    request = Request(peer_url.rstrip('/') + quote(path), data=data, method=method, headers=headers)
+    return urlopen(request, timeout=app.config['CLUSTER_PEER_TIMEOUT'])
+
+
+def record_replica(file_id, tier=HOT):
+    replica = db.session.get(FileReplica, (file_id, node_id()))
+    if replica is None:
+        db.session.add(FileReplica(file_id=file_id, node_id=node_id(), storage_tier=tier))
+    else:
+        replica.storage_tier = tier
+
+
+def store_replica(stream, filename, expected_digest=None):
+    """Write ``stream`` to the local hot store in chunks; returns the path.
+
+    With ``expected_digest`` the copy is only kept if its SHA-256 matches,
+    otherwise ValueError is raised and nothing is replaced.
+    """
+    folder = tier_folder(HOT)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, filename)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+    chunk_size = app.config['ARCHIVE_CHUNK_SIZE']
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        if expected_digest is not None and not hmac.compare_digest(digest.hexdigest(), expected_digest):
+            raise ValueError(f'{filename} does not match its signed digest')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def open_from_peer(file):
+    """Streaming HTTP response for ``file`` from a peer holding it, or None."""
+    known_peers = peers()
+    for replica in file.replicas:
+        url = known_peers.get(replica.node_id)
+        if url is None:
+            continue
+        try:
+            return peer_request(url, 'GET', f'/api/internal/files/{file.id}/content')
+        except OSError as e:
+            logger.warning('Could not fetch file %s from %s: %s', file.id, replica.node_id, e)
+    return None
+
+
+def ensure_local(file):
+    """Path of a local copy of ``file``, pulling one from a peer if needed.
+
+    Pulled copies are recorded as replicas; the caller commits.
+    """
+    path = local_path(file)
+    if path is None and cluster_enabled():
+        upstream = open_from_peer(file)
+        if upstream is not None:
+            with upstream:
+                path = store_replica(upstream, file.filename)
+            record_replica(file.id)
+    if path is None:
+        raise FileNotFoundError(file.filename)
+    return path
+
+
+class Replicator(PerProcess):
+    """Background pushes and deletes to peers, one thread per process."""
+
+    def __init__(self):
+        super().__init__()
+        self.queue = None
+        self.failed = 0
+
+    def _start(self):
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, args=(self.queue,), name='replicator', daemon=True).start()
+
+    def push(self, file_id, path, targets=None):
+        self.ensure_started()
+        for name, url in peers().items():
+            if targets is None or name in targets:
+                self.queue.put(('push', name, url, file_id, path, 0))
+
+    def delete(self, filename):
+        self.ensure_started()
+        for name, url in peers().items():
+            self.queue.put(('delete', name, url, filename, None, 0))
+
+    def join(self):
+        if self.started_here():
+            self.queue.join()
+
+    def _run(self, tasks):
+        while True:
+            task = tasks.get()
+            retry = None
+            try:
+                retry = self._attempt(task)
+            finally:
+                if retry is None:
+                    tasks.task_done()
+                else:
+                    # The task stays unfinished until its retry is queued, so
+                    # join() also waits for retries
+                    delay, next_task = retry
+                    timer = threading.Timer(delay, self._requeue, args=(tasks, next_task))
+                    timer.daemon = True
+                    timer.start()
+
+    @staticmethod
+    def _requeue(tasks, task):
+        tasks.put(task)
+        tasks.task_done()
+
+    def _attempt(self, task):
+        """Run one push or delete; returns ``(delay, task)`` when it should be retried."""
+        action, name, url, target, path, attempt = task
+        try:
+            if action == 'push':
+                digest = file_digest(path)
+                with open(path, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    peer_request(url, 'PUT', f'/api/internal/files/{target}/replica', data=f, headers={
+                        'Content-Length': str(size),
+                        'Content-Type': 'application/octet-stream'
+                    }, digest=digest).close()
+            else:
+                peer_request(url, 'DELETE', f'/api/internal/replicas/{target}').close()
+        except FileNotFoundError:
+            # Deleted locally before it could be replicated
+            return None
+        except OSError as e:
+            if attempt + 1 >= app.config['CLUSTER_REPLICATION_RETRIES']:
+                logger.error('Giving up on %s of %s to %s: %s', action, target, name, e)
+                self.failed += 1
+                return None
+            delay = min(2 ** attempt, 30)
+            logger.warning('Retrying %s of %s to %s in %ss: %s', action, target, name, delay, e)
+            return delay, (action, name, url, target, path, attempt + 1)
+        return None
+
+
+replicator = Replicator()
+
+
+def repair_replicas():
+    """Record replicas for local files and queue pushes to peers missing them.
+
+    Also covers files uploaded before cluster mode was turned on, and puts
+    this node's recorded tier right if its copy is on the other one.
+    """
+    queued = 0
+    known_peers = set(peers())
+    for file in File.query.order_by(File.id).yield_per(500):
+        path = local_path(file)
+        if path is None:
+            continue
+        holders = {replica.node_id: replica for replica in file.replicas}
+        own = holders.get(node_id())
+        if own is None or own.storage_tier != tier_of(path):
+            record_replica(file.id, tier_of(path))
+        missing = known_peers - set(holders)
+        if missing:
+            replicator.push(file.id, path, targets=missing)
+            queued += len(missing)
+    db.session.commit()
+    return queued
@@ -1,12 +1,55 @@
 import os
+import socket
 from datetime import timedelta
 
+# Flask's default instance folder for this app, i.e. app.instance_path
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    DOWNLOAD_LINK_KEY = os.getenv('DOWNLOAD_LINK_KEY')  # Fernet key shared by all workers and nodes
+    ARCHIVE_MAX_FILES = int(os.getenv('ARCHIVE_MAX_FILES', 100))
+    ARCHIVE_CHUNK_SIZE = 64 * 1024  # 64KB read size when streaming archives
+    
+    # Storage quota and lifecycle settings
+    STORAGE_QUOTA_BYTES = int(os.getenv('STORAGE_QUOTA_BYTES', 0)) or None  # per uploader, unset = unlimited
+    COLD_STORAGE_FOLDER = os.getenv('COLD_STORAGE_FOLDER', 'uploads_cold')
+    COLD_AFTER_DAYS = int(os.getenv('COLD_AFTER_DAYS', 30))
+    ACCESS_FLUSH_INTERVAL = 30  # seconds between batched last_accessed_at writes
+    
+    # Change feed settings
+    CHANGE_FEED_PAGE_SIZE = 500
+    CHANGE_FEED_MAX_WAIT = 25  # seconds; keep below the gunicorn worker timeout
+    CHANGE_FEED_POLL_INTERVAL = 1.0
+    
+    # Cluster settings; CLUSTER_PEERS is "name=url,name=url" and includes this node
+    NODE_ID = os.getenv('NODE_ID', socket.gethostname())
+    CLUSTER_PEERS = dict(peer.split('=', 1) for peer in os.getenv('CLUSTER_PEERS', '').split(',') if peer)
+    CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+    CLUSTER_PEER_TIMEOUT = 10  # seconds
+    CLUSTER_REPLICATION_RETRIES = 5
+    CLUSTER_SIGNATURE_MAX_AGE = 60  # seconds of clock skew and transit allowed
+    
+    # Token revocation settings
+    REVOCATION_BLOOM_FILE = os.getenv('REVOCATION_BLOOM_FILE', os.path.join(INSTANCE_PATH, 'revoked_tokens.bloom'))
+    REVOCATION_BLOOM_CAPACITY = int(os.getenv('REVOCATION_BLOOM_CAPACITY', 100000))
+    REVOCATION_BLOOM_ERROR_RATE = 0.001
+    REVOCATION_SYNC_INTERVAL = 5  # seconds between pulls of revocations made elsewhere
+    REVOCATION_SYNC_OVERLAP = 300  # seconds each pull reaches back for late commits and clock skew
+    
+    # Request logging settings
+    REQUEST_LOG_ENABLED = os.getenv('REQUEST_LOG_ENABLED', 'True') == 'True'
+    REQUEST_LOG_FILE = os.getenv('REQUEST_LOG_FILE')  # stderr when unset
+    REQUEST_LOG_QUEUE_SIZE = 10000
+    REQUEST_LOG_SLOW_MS = int(os.getenv('REQUEST_LOG_SLOW_MS', 1000))
+    REQUEST_LOG_SAMPLE_RATES = {
+        'download_file': float(os.getenv('DOWNLOAD_LOG_SAMPLE_RATE', 0.1)),
+        'download_archive': float(os.getenv('DOWNLOAD_LOG_SAMPLE_RATE', 0.1))
+    }
     
     # Mail settings
     MAIL_SERVER = os.getenv('MAIL_SERVER')
@@ -6,9 +6,12 @@ bind = "0.0.0.0:8000"
 backlog = 2048
 
 # Worker processes
+# Threaded workers: long-polls and streams on /api/ops/changes hold a thread
+# for up to CHANGE_FEED_MAX_WAIT seconds, and a sync worker would be tied up
+# as a whole process for each consumer.
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
-worker_connections = 1000
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
 timeout = 30
 keepalive = 2
 
@@ -16,9 +19,13 @@ keepalive = 2
 proc_name = 'filesharing'
 
 # Logging
-accesslog = "logs/access.log"
+# The app writes structured JSON request logs from a background thread
+# (see request_log.py), so gunicorn's synchronous access log is off unless
+# GUNICORN_ACCESS_LOG is set.
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
 errorlog = "logs/error.log"
 loglevel = "info"
+raw_env = ["REQUEST_LOG_FILE=" + os.getenv('REQUEST_LOG_FILE', 'logs/requests.log')]
 
 # SSL Configuration
 # keyfile = 'path/to/keyfile'
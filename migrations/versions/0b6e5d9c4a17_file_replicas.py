@@ -0,0 +1,30 @@
+"""file replicas
+
+Revision ID: 0b6e5d9c4a17
+Revises: f19a7c3d2e85
+Create Date: 2026-10-19 18:47:30.915842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e5d9c4a17'
+down_revision = 'f19a7c3d2e85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_replica',
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('node_id', sa.String(length=64), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['file_id'], ['file.id'], ),
+    sa.PrimaryKeyConstraint('file_id', 'node_id')
+    )
+
+
+def downgrade():
+    op.drop_table('file_replica')
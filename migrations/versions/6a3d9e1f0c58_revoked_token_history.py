@@ -0,0 +1,42 @@
+"""revoked token history
+
+Revision ID: 6a3d9e1f0c58
+Revises: 0b6e5d9c4a17
+Create Date: 2026-10-19 19:04:41.518392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3d9e1f0c58'
+down_revision = '0b6e5d9c4a17'
+branch_labels = None
+depends_on = None
+
+# Names the unnamed unique constraint SQLite reflects, so batch mode can drop it
+naming_convention = {'uq': 'uq_%(table_name)s_%(column_0_name)s'}
+
+
+def upgrade():
+    unique_key = next(
+        constraint['name'] for constraint in sa.inspect(op.get_bind()).get_unique_constraints('revoked_token')
+        if constraint['column_names'] == ['key']
+    )
+    with op.batch_alter_table('revoked_token', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint(unique_key or 'uq_revoked_token_key', type_='unique')
+        batch_op.create_index(batch_op.f('ix_revoked_token_key'), ['key'], unique=False)
+        batch_op.create_index(batch_op.f('ix_revoked_token_revoked_at'), ['revoked_at'], unique=False)
+
+
+def downgrade():
+    # Keep only the latest revocation per key so the unique constraint fits
+    op.execute(
+        'DELETE FROM revoked_token WHERE id NOT IN '
+        '(SELECT MAX(id) FROM revoked_token GROUP BY key)'
+    )
+    with op.batch_alter_table('revoked_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_revoked_token_revoked_at'))
+        batch_op.drop_index(batch_op.f('ix_revoked_token_key'))
+        batch_op.create_unique_constraint('revoked_token_key_key', ['key'])
@@ -0,0 +1,141 @@
+"""file access control
+
+Revision ID: 8a1c2e4f7b90
+Revises: 5d6f66564c01
+Create Date: 2026-10-19 10:12:41.503218
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a1c2e4f7b90'
+down_revision = '5d6f66564c01'
+branch_labels = None
+depends_on = None
+
+# Before this revision every client saw every file. Existing files are shared
+# with this group, which holds the existing clients, so nothing disappears on
+# upgrade; ops can then narrow access or add new clients to the group.
+EXISTING_CLIENTS_GROUP = 'Existing clients'
+
+# The backfill writes one file_access row per (client, file) pair, so it goes
+# in blocks of this many clients times this many files. No single statement
+# writes more than 100,000 rows, however large the install.
+BACKFILL_CLIENTS_PER_BATCH = 100
+BACKFILL_FILES_PER_BATCH = 1000
+
+
+def upgrade():
+    op.create_table('group',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('group_member',
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['group.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('group_id', 'user_id')
+    )
+    op.create_index(op.f('ix_group_member_user_id'), 'group_member', ['user_id'], unique=False)
+    op.create_table('file_grant',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('group_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('(user_id IS NULL) != (group_id IS NULL)', name='ck_file_grant_target'),
+    sa.ForeignKeyConstraint(['file_id'], ['file.id'], ),
+    sa.ForeignKeyConstraint(['group_id'], ['group.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('file_id', 'group_id'),
+    sa.UniqueConstraint('file_id', 'user_id')
+    )
+    op.create_index(op.f('ix_file_grant_group_id'), 'file_grant', ['group_id'], unique=False)
+    op.create_index(op.f('ix_file_grant_user_id'), 'file_grant', ['user_id'], unique=False)
+    op.create_table('file_access',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['file_id'], ['file.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'file_id')
+    )
+    op.create_index(op.f('ix_file_access_file_id'), 'file_access', ['file_id'], unique=False)
+
+    backfill_existing_access()
+
+
+def backfill_existing_access():
+    conn = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('role', sa.String))
+    file = sa.table('file', sa.column('id', sa.Integer))
+    group = sa.table('group', sa.column('id', sa.Integer), sa.column('name', sa.String),
+                     sa.column('created_at', sa.DateTime))
+    group_member = sa.table('group_member', sa.column('group_id', sa.Integer), sa.column('user_id', sa.Integer))
+    file_grant = sa.table('file_grant', sa.column('file_id', sa.Integer), sa.column('group_id', sa.Integer),
+                          sa.column('created_at', sa.DateTime))
+    file_access = sa.table('file_access', sa.column('user_id', sa.Integer), sa.column('file_id', sa.Integer))
+
+    if not conn.execute(sa.select(sa.func.count()).select_from(file)).scalar():
+        return
+
+    now = datetime.utcnow()
+    conn.execute(group.insert().values(name=EXISTING_CLIENTS_GROUP, created_at=now))
+    group_id = conn.execute(sa.select(group.c.id).where(group.c.name == EXISTING_CLIENTS_GROUP)).scalar()
+    clients = user.c.role == 'client'
+    client_batches = list(_id_batches(conn, user, BACKFILL_CLIENTS_PER_BATCH, clients))
+    file_batches = list(_id_batches(conn, file, BACKFILL_FILES_PER_BATCH))
+
+    for first, last in client_batches:
+        conn.execute(group_member.insert().from_select(
+            ['group_id', 'user_id'],
+            sa.select(sa.literal(group_id), user.c.id).where(clients, user.c.id.between(first, last))
+        ))
+    for first, last in file_batches:
+        conn.execute(file_grant.insert().from_select(
+            ['file_id', 'group_id', 'created_at'],
+            sa.select(file.c.id, sa.literal(group_id), sa.literal(now, sa.DateTime))
+            .where(file.c.id.between(first, last))
+        ))
+    for first_client, last_client in client_batches:
+        for first_file, last_file in file_batches:
+            conn.execute(file_access.insert().from_select(
+                ['user_id', 'file_id'],
+                sa.select(user.c.id, file.c.id).where(
+                    clients,
+                    user.c.id.between(first_client, last_client),
+                    file.c.id.between(first_file, last_file)
+                )
+            ))
+
+
+def _id_batches(conn, table, size, *criteria):
+    """Yield (first, last) id bounds that each cover ``size`` matching rows."""
+    last_id = 0
+    while True:
+        ids = conn.execute(
+            sa.select(table.c.id).where(table.c.id > last_id, *criteria).order_by(table.c.id).limit(size)
+        ).scalars().all()
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+
+def downgrade():
+    op.drop_index(op.f('ix_file_access_file_id'), table_name='file_access')
+    op.drop_table('file_access')
+    op.drop_index(op.f('ix_file_grant_user_id'), table_name='file_grant')
+    op.drop_index(op.f('ix_file_grant_group_id'), table_name='file_grant')
+    op.drop_table('file_grant')
+    op.drop_index(op.f('ix_group_member_user_id'), table_name='group_member')
+    op.drop_table('group_member')
+    op.drop_table('group')
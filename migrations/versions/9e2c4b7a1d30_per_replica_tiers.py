@@ -0,0 +1,59 @@
+"""per replica storage tiers
+
+Revision ID: 9e2c4b7a1d30
+Revises: 6a3d9e1f0c58
+Create Date: 2026-10-19 20:12:08.640271
+
+"""
+from flask import current_app
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2c4b7a1d30'
+down_revision = '6a3d9e1f0c58'
+branch_labels = None
+depends_on = None
+
+file = sa.table('file', sa.column('id', sa.Integer), sa.column('created_at', sa.DateTime),
+                sa.column('storage_tier', sa.String))
+file_replica = sa.table('file_replica', sa.column('file_id', sa.Integer), sa.column('node_id', sa.String),
+                        sa.column('created_at', sa.DateTime), sa.column('storage_tier', sa.String))
+
+
+def upgrade():
+    with op.batch_alter_table('file_replica', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage_tier', sa.String(length=10), server_default='hot', nullable=False))
+
+    # Existing copies take the file's shared tier. Files with no replica row
+    # yet are recorded as held by the node running the upgrade; in a cluster
+    # the lifecycle job on each node corrects its own rows.
+    op.execute(file_replica.update().values(storage_tier=(
+        sa.select(file.c.storage_tier).where(file.c.id == file_replica.c.file_id).scalar_subquery()
+    )))
+    op.execute(file_replica.insert().from_select(
+        ['file_id', 'node_id', 'created_at', 'storage_tier'],
+        sa.select(file.c.id, sa.literal(current_app.config['NODE_ID']), file.c.created_at, file.c.storage_tier)
+        .where(~sa.exists().where(file_replica.c.file_id == file.c.id))
+    ))
+
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_column('storage_tier')
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage_tier', sa.String(length=10), server_default='hot', nullable=False))
+
+    # Back to one shared tier: take this node's
+    op.execute(file.update().values(storage_tier=sa.func.coalesce(
+        sa.select(file_replica.c.storage_tier).where(
+            file_replica.c.file_id == file.c.id,
+            file_replica.c.node_id == current_app.config['NODE_ID']
+        ).scalar_subquery(),
+        'hot'
+    )))
+
+    with op.batch_alter_table('file_replica', schema=None) as batch_op:
+        batch_op.drop_column('storage_tier')
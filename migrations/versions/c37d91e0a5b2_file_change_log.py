@@ -0,0 +1,33 @@
+"""file change log
+
+Revision ID: c37d91e0a5b2
+Revises: 8a1c2e4f7b90
+Create Date: 2026-10-19 11:40:06.118934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c37d91e0a5b2'
+down_revision = '8a1c2e4f7b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event', sa.String(length=20), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('file_type', sa.String(length=10), nullable=False),
+    sa.Column('uploaded_by', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('file_event')
@@ -0,0 +1,40 @@
+"""storage accounting and tiers
+
+Revision ID: e4b8f1a2c6d3
+Revises: c37d91e0a5b2
+Create Date: 2026-10-19 14:02:57.664120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8f1a2c6d3'
+down_revision = 'c37d91e0a5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage_used_bytes', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('storage_quota_bytes', sa.BigInteger(), nullable=True))
+
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size_bytes', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_accessed_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('storage_tier', sa.String(length=10), server_default='hot', nullable=False))
+        batch_op.create_index(batch_op.f('ix_file_last_accessed_at'), ['last_accessed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_file_last_accessed_at'))
+        batch_op.drop_column('storage_tier')
+        batch_op.drop_column('last_accessed_at')
+        batch_op.drop_column('size_bytes')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('storage_quota_bytes')
+        batch_op.drop_column('storage_used_bytes')
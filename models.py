@@ -9,6 +9,9 @@ class User(db.Model):
     is_verified = db.Column(db.Boolean, default=False)
     verification_token = db.Column(db.String(100), unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Running total of uploaded bytes, kept in step with uploads and deletes
+    storage_used_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    storage_quota_bytes = db.Column(db.BigInteger)  # None means STORAGE_QUOTA_BYTES applies
 
 class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,5 +21,70 @@ class File(db.Model):
     uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     download_token = db.Column(db.String(100), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    last_accessed_at = db.Column(db.DateTime, index=True)
     
-    uploader = db.relationship('User', backref=db.backref('files', lazy=True)) 
\ No newline at end of file
+    uploader = db.relationship('User', backref=db.backref('files', lazy=True)) 
+
+class Group(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class GroupMember(db.Model):
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, index=True)
+
+    group = db.relationship('Group', backref=db.backref('members', lazy=True, cascade='all, delete-orphan'))
+
+class FileGrant(db.Model):
+    # A grant names either a single user or a whole group
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('group.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('file_id', 'user_id'),
+        db.UniqueConstraint('file_id', 'group_id'),
+        db.CheckConstraint('(user_id IS NULL) != (group_id IS NULL)', name='ck_file_grant_target'),
+    )
+
+    file = db.relationship('File', backref=db.backref('grants', lazy=True, cascade='all, delete-orphan'))
+
+class FileAccess(db.Model):
+    # Denormalized (user, file) pairs resolved from grants, kept in sync by acl.py
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), primary_key=True, index=True)
+
+    file = db.relationship('File', backref=db.backref('access', lazy=True, cascade='all, delete-orphan'))
+
+class FileEvent(db.Model):
+    # Append-only change log; the id doubles as the feed offset. No foreign
+    # key to file so 'deleted' events outlive the row they describe.
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(20), nullable=False)  # 'created' or 'deleted'
+    file_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(10), nullable=False)
+    uploaded_by = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RevokedToken(db.Model):
+    # key is a token's jti, or 'user:<id>' to revoke everything issued to a user before revoked_at;
+    # a user key gets a new row each time, so keys repeat
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class FileReplica(db.Model):
+    # One row per node holding a copy of the file in its local store; each
+    # node tiers its own copy
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), primary_key=True)
+    node_id = db.Column(db.String(64), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    storage_tier = db.Column(db.String(10), nullable=False, default='hot', server_default='hot')  # 'hot' or 'cold'
+
+    file = db.relationship('File', backref=db.backref('replicas', lazy=True, cascade='all, delete-orphan'))
@@ -0,0 +1,31 @@
+import os
+import threading
+
+# gunicorn forks its workers after the app is imported, and background
+# threads and memory maps do not survive a fork. Objects that own them start
+# lazily, once in each process, through this mixin.
+
+
+class PerProcess:
+    """Run ``_start()`` once per process, the first time ``ensure_started()`` is called.
+
+    Safe when several request threads get there together.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        raise NotImplementedError
+
+    def started_here(self):
+        return self.pid == os.getpid()
+
+    def ensure_started(self):
+        if self.started_here():
+            return
+        with self._start_lock:
+            if not self.started_here():
+                self._start()
+                self.pid = os.getpid()
@@ -0,0 +1,197 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.wsgi import ClosingIterator, FileWrapper
+
+from per_process import PerProcess
+
+# Structured per-request logging.
+#
+# Handlers only put a record on a bounded in-memory queue; a background
+# listener thread formats it as JSON and writes it out, so request threads
+# never block on log I/O. High-volume endpoints can be sampled, and a
+# per-phase timing breakdown is attached only to requests slower than
+# REQUEST_LOG_SLOW_MS.
+#
+# File downloads are logged when the handler returns, so gunicorn can still
+# send them with sendfile; their duration and 'disk' time cover finding and
+# opening the file, not the transfer. Generated bodies (archives, peer
+# proxies, event streams) are logged when they finish streaming.
+
+request_logger = logging.getLogger('filesharing.requests')
+
+PHASES = ('auth', 'db', 'crypto', 'disk')
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        payload = getattr(record, 'payload', None) or {'message': record.getMessage()}
+        return json.dumps(payload, separators=(',', ':'), default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Writer(PerProcess):
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.listener = None
+        self.handler = None
+
+    def _start(self):
+        log_file = self.app.config.get('REQUEST_LOG_FILE')
+        if log_file:
+            os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+            target = logging.FileHandler(log_file)
+        else:
+            target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(JSONFormatter())
+
+        if self.handler is not None:
+            request_logger.removeHandler(self.handler)
+        self.handler = DroppingQueueHandler(queue.Queue(self.app.config['REQUEST_LOG_QUEUE_SIZE']))
+        self.listener = QueueListener(self.handler.queue, target)
+        self.listener.start()
+        request_logger.addHandler(self.handler)
+
+    def stop(self):
+        if self.listener is not None and self.started_here():
+            self.listener.stop()
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to ``phase`` for the current request."""
+    if not has_request_context() or 'log_phases' not in g:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.log_phases[phase] += time.perf_counter() - started
+
+
+def log_fields(**fields):
+    """Attach extra fields (file id, byte counts...) to this request's log entry."""
+    if has_request_context() and 'log_fields' in g:
+        g.log_fields.update(fields)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'log_phases' in g:
+        context._log_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_log_started', None)
+    if started is not None and has_request_context() and 'log_phases' in g:
+        g.log_phases['db'] += time.perf_counter() - started
+
+
+def _user_id():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+def init_request_logging(app):
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+    writer = _Writer(app)
+    atexit.register(writer.stop)
+
+    @app.before_request
+    def start_request_log():
+        if not app.config['REQUEST_LOG_ENABLED']:
+            return
+        writer.ensure_started()
+        g.log_started = time.perf_counter()
+        g.log_phases = defaultdict(float)
+        g.log_fields = {}
+
+    @app.after_request
+    def finish_request_log(response):
+        if 'log_started' not in g:
+            return response
+
+        started = g.log_started
+        phases = g.log_phases
+        slow_ms = app.config['REQUEST_LOG_SLOW_MS']
+        rate = app.config['REQUEST_LOG_SAMPLE_RATES'].get(request.endpoint, 1.0)
+        # Log the route pattern rather than the path, which for downloads
+        # carries the token
+        path = request.url_rule.rule if request.url_rule is not None else request.path
+        payload = {
+            'ts': datetime.now(timezone.utc).isoformat(),
+            'method': request.method,
+            'path': path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'user_id': _user_id(),
+            'bytes': response.content_length,
+            'remote_addr': request.remote_addr,
+            # Never log download tokens, they are bearer credentials
+            **{k: v for k, v in (request.view_args or {}).items() if k != 'token'},
+            **g.log_fields
+        }
+
+        # Slow requests and server errors bypass sampling
+        def emit():
+            duration_ms = (time.perf_counter() - started) * 1000
+            slow = duration_ms >= slow_ms
+            if not slow and payload['status'] < 500 and rate < 1.0 and random.random() >= rate:
+                return
+            payload['duration_ms'] = round(duration_ms, 3)
+            if rate < 1.0:
+                payload['sample_rate'] = rate
+            if slow:
+                payload['slow'] = True
+                payload['phases_ms'] = {phase: round(phases[phase] * 1000, 3) for phase in PHASES}
+            request_logger.info(path, extra={'payload': payload})
+
+        body = response.response
+        file_wrapper = request.environ.get('wsgi.file_wrapper', FileWrapper)
+        if response.is_sequence or isinstance(body, (FileWrapper, file_wrapper)):
+            # Size is known up front; wrapping a file body would cost sendfile
+            emit()
+        else:
+            # call_on_close hooks are skipped for direct_passthrough
+            # responses, so close generated bodies ourselves
+            response.response = ClosingIterator(body, emit)
+        return response
+
+    return writer
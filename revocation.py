@@ -0,0 +1,132 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import app, db, jwt
+from bloom import BloomFilter
+from models import RevokedToken
+from per_process import PerProcess
+
+# Access token revocation.
+#
+# RevokedToken is the source of truth: one row per revoked JTI, plus a
+# 'user:<id>' row each time all of a user's tokens are revoked (logout
+# everywhere, disable, demote). Every worker checks a shared bloom filter of those keys
+# first, so a token that was never revoked is accepted without touching the
+# database. Only a probable hit is confirmed with an indexed lookup.
+#
+# Workers add their own revocations to the filter directly. Every
+# REVOCATION_SYNC_INTERVAL seconds a worker also pulls rows revoked since its
+# last pull, which picks up revocations made on other hosts and repairs any
+# bits lost to a filter swap. The pull goes by revoked_at rather than id and
+# reaches back REVOCATION_SYNC_OVERLAP seconds: ids become visible in commit
+# order, not id order, and hosts' clocks drift, so a plain high-water mark
+# would skip rows for good.
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+
+class RevocationList(PerProcess):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.synced_until = None
+        self.last_sync = 0.0
+
+    def _start(self):
+        self.bloom = BloomFilter(
+            app.config['REVOCATION_BLOOM_FILE'],
+            app.config['REVOCATION_BLOOM_CAPACITY'],
+            app.config['REVOCATION_BLOOM_ERROR_RATE']
+        )
+        self.synced_until = None
+        self.last_sync = 0.0
+
+    def _filter(self):
+        self.ensure_started()
+        return self.bloom
+
+    def sync(self, force=False):
+        bloom = self._filter()
+        now = time.monotonic()
+        if not force and now - self.last_sync < app.config['REVOCATION_SYNC_INTERVAL']:
+            return
+        with self.lock:
+            self.last_sync = now
+            if bloom.replaced():
+                bloom.open()
+                self.synced_until = None
+            started = _utcnow()
+            query = db.session.query(RevokedToken.key).filter(RevokedToken.expires_at > started)
+            if self.synced_until is not None:
+                overlap = timedelta(seconds=app.config['REVOCATION_SYNC_OVERLAP'])
+                query = query.filter(RevokedToken.revoked_at > self.synced_until - overlap)
+            for key, in query:
+                bloom.add(key)
+            self.synced_until = started
+
+    def add(self, key):
+        self._filter().add(key)
+
+    def might_contain(self, key):
+        return key in self._filter()
+
+
+revocations = RevocationList()
+
+
+def revoke_token(jwt_payload):
+    """Revoke a single token by JTI until it would have expired anyway."""
+    expires_at = datetime.fromtimestamp(jwt_payload['exp'], timezone.utc).replace(tzinfo=None)
+    if RevokedToken.query.filter_by(key=jwt_payload['jti']).first() is None:
+        db.session.add(RevokedToken(key=jwt_payload['jti'], revoked_at=_utcnow(), expires_at=expires_at))
+    revocations.add(jwt_payload['jti'])
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every token issued to ``user_id`` up to now.
+
+    Always a new row, never an update, so other hosts see it on their next
+    sync.
+    """
+    now = _utcnow()
+    key = user_key(user_id)
+    db.session.add(RevokedToken(key=key, revoked_at=now, expires_at=now + app.config['JWT_ACCESS_TOKEN_EXPIRES']))
+    revocations.add(key)
+
+
+def prune_revocations():
+    """Drop expired rows and rebuild the filter without them.
+
+    Bloom filters cannot delete, so the filter is rebuilt from the live rows
+    and swapped in; workers notice the new file on their next sync.
+    """
+    db.session.query(RevokedToken).filter(RevokedToken.expires_at <= _utcnow()).delete()
+    db.session.commit()
+    bloom = revocations._filter()
+    BloomFilter.reset(bloom.path, (bloom.size + 7) // 8)
+    revocations.sync(force=True)
+
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    revocations.sync()
+
+    jti = jwt_payload['jti']
+    if revocations.might_contain(jti) and RevokedToken.query.filter_by(key=jti).first() is not None:
+        return True
+
+    key = user_key(jwt_payload['sub'])
+    if revocations.might_contain(key):
+        issued_at = datetime.fromtimestamp(jwt_payload['iat'], timezone.utc).replace(tzinfo=None)
+        # iat has one-second resolution; a token from the same second counts as revoked
+        if RevokedToken.query.filter(RevokedToken.key == key, RevokedToken.revoked_at >= issued_at).first() is not None:
+            return True
+    return False
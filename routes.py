@@ -1,25 +1,82 @@
-from flask import request, jsonify, send_from_directory, url_for, render_template
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask import request, jsonify, send_from_directory, url_for, render_template, Response, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from flask_mail import Message
 from werkzeug.utils import secure_filename
+import hashlib
 import os
 import uuid
 from cryptography.fernet import Fernet
 import mimetypes
+from sqlalchemy import and_, null
 
 from app import app, db, mail, bcrypt
-from models import User, File
+from models import User, File, Group, FileReplica
+from acl import visible_files, grant, revoke, add_member, remove_member
+from archive import ZipStream, build_entries
+from changes import record_event, fetch_events, wait_for_events, stream_events
+from request_log import timed, log_fields
+from storage import reserve_quota, release_quota, access_tracker, recall, local_path
+from revocation import revoke_token, revoke_user_tokens
+from cluster import (cluster_enabled, verify_peer_request, record_replica, store_replica,
+                     open_from_peer, ensure_local, replicator)
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'pptx', 'docx', 'xlsx'}
 
-# Generate encryption key for Fernet
-encryption_key = Fernet.generate_key()
+# Columns returned by file listings. Rows are serialized directly by the
+# JSON provider, so the labels are the response keys.
+FILE_LISTING_COLUMNS = (
+    File.id,
+    File.original_filename.label('filename'),
+    File.file_type.label('type'),
+    File.created_at.label('uploaded_at')
+)
+
+# Encryption key for Fernet. Every worker and node must share it, otherwise a
+# download link only works on the process that minted it.
+encryption_key = app.config['DOWNLOAD_LINK_KEY'] or Fernet.generate_key()
 fernet = Fernet(encryption_key)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def grant_targets_error(user_ids, group_ids):
+    if User.query.filter(User.id.in_(user_ids)).count() != len(set(user_ids)):
+        return 'Unknown user in user_ids'
+    if Group.query.filter(Group.id.in_(group_ids)).count() != len(set(group_ids)):
+        return 'Unknown group in group_ids'
+    return None
+
+def parse_feed_args():
+    # EventSource reconnects send Last-Event-ID, which wins over the original ?since=
+    since = request.headers.get('Last-Event-ID', request.args.get('since', 0))
+    try:
+        since = int(since)
+        limit = min(int(request.args.get('limit', app.config['CHANGE_FEED_PAGE_SIZE'])), app.config['CHANGE_FEED_PAGE_SIZE'])
+        wait = min(float(request.args.get('wait', 0)), app.config['CHANGE_FEED_MAX_WAIT'])
+    except ValueError:
+        return None
+    if since < 0 or limit < 1 or not wait >= 0:
+        return None
+    return since, limit, wait
+
+def proxy_download(file):
+    upstream = open_from_peer(file)
+    if upstream is None:
+        return jsonify({'message': 'File not available'}), 404
+    
+    def generate():
+        with upstream:
+            for chunk in iter(lambda: upstream.read(app.config['ARCHIVE_CHUNK_SIZE']), b''):
+                yield chunk
+    
+    response = Response(generate(), mimetype=upstream.headers.get('Content-Type', 'application/octet-stream'),
+                        direct_passthrough=True)
+    if upstream.headers.get('Content-Length'):
+        response.headers['Content-Length'] = upstream.headers['Content-Length']
+    response.headers.set('Content-Disposition', 'attachment', filename=file.original_filename)
+    return response
+
 def send_verification_email(user_email, token):
     msg = Message('Email Verification',
                  sender=app.config['MAIL_USERNAME'],
@@ -36,14 +93,23 @@ def home():
             'client': {
                 'signup': '/api/client/signup',
                 'login': '/api/client/login',
+                'logout': '/api/logout',
                 'list_files': '/api/client/files',
-                'download': '/api/client/download/<file_id>'
+                'download': '/api/client/download/<file_id>',
+                'download_archive': '/api/client/download/archive'
             },
             'ops': {
                 'login': '/api/ops/login',
                 'upload': '/api/ops/upload',
                 'list_files': '/api/ops/files',
-                'delete_file': '/api/ops/files/delete/<file_id>'
+                'delete_file': '/api/ops/files/delete/<file_id>',
+                'file_grants': '/api/ops/files/<file_id>/grants',
+                'groups': '/api/ops/groups',
+                'group_members': '/api/ops/groups/<group_id>/members',
+                'usage': '/api/ops/usage',
+                'revoke_user_tokens': '/api/ops/users/<user_id>/revoke-tokens',
+                'changes': '/api/ops/changes',
+                'changes_stream': '/api/ops/changes/stream'
             }
         }
     }), 200
@@ -53,7 +119,10 @@ def ops_login():
     data = request.get_json()
     user = User.query.filter_by(email=data['email'], role='ops').first()
     
-    if user and bcrypt.check_password_hash(user.password, data['password']):
+    with timed('auth'):
+        valid = user is not None and bcrypt.check_password_hash(user.password, data['password'])
+    
+    if valid:
         access_token = create_access_token(identity=user.id)
         return jsonify({'access_token': access_token}), 200
     
@@ -83,7 +152,8 @@ def upload_file():
     unique_filename = f"{str(uuid.uuid4())}_{filename}"
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
     
-    file.save(file_path)
+    with timed('disk'):
+        file.save(file_path)
     
     # Verify file type using mimetypes
     file_type = mimetypes.guess_type(filename)[0]
@@ -91,6 +161,24 @@ def upload_file():
         os.remove(file_path)
         return jsonify({'message': 'Invalid file type'}), 400
     
+    try:
+        user_ids = [int(i) for i in request.form.getlist('user_ids')]
+        group_ids = [int(i) for i in request.form.getlist('group_ids')]
+    except ValueError:
+        os.remove(file_path)
+        return jsonify({'message': 'user_ids and group_ids must be integers'}), 400
+    
+    error = grant_targets_error(user_ids, group_ids)
+    if error:
+        os.remove(file_path)
+        return jsonify({'message': error}), 400
+    
+    # Charge the upload against the uploader's quota
+    size_bytes = os.path.getsize(file_path)
+    if not reserve_quota(user, size_bytes):
+        os.remove(file_path)
+        return jsonify({'message': 'Storage quota exceeded'}), 413
+    
     # Generate encrypted download token
     download_token = str(uuid.uuid4())
     
@@ -99,12 +187,22 @@ def upload_file():
         original_filename=filename,
         file_type=filename.rsplit('.', 1)[1].lower(),
         uploaded_by=user_id,
-        download_token=download_token
+        download_token=download_token,
+        size_bytes=size_bytes
     )
     
     db.session.add(new_file)
+    db.session.flush()
+    log_fields(file_id=new_file.id)
+    grant(new_file.id, user_ids, group_ids)
+    record_replica(new_file.id)
+    record_event(new_file, 'created')
     db.session.commit()
     
+    # Copy to the other nodes in the background once the row is visible to them
+    if cluster_enabled():
+        replicator.push(new_file.id, file_path)
+    
     return jsonify({'message': 'File uploaded successfully'}), 201
 
 @app.route('/api/client/signup', methods=['POST'])
@@ -114,7 +212,8 @@ def client_signup():
     if User.query.filter_by(email=data['email']).first():
         return jsonify({'message': 'Email already registered'}), 400
     
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    with timed('auth'):
+        hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
     verification_token = str(uuid.uuid4())
     
     new_user = User(
@@ -150,7 +249,10 @@ def client_login():
     data = request.get_json()
     user = User.query.filter_by(email=data['email'], role='client').first()
     
-    if not user or not bcrypt.check_password_hash(user.password, data['password']):
+    with timed('auth'):
+        valid = user is not None and bcrypt.check_password_hash(user.password, data['password'])
+    
+    if not valid:
         return jsonify({'message': 'Invalid credentials'}), 401
     
     if not user.is_verified:
@@ -159,6 +261,14 @@ def client_login():
     access_token = create_access_token(identity=user.id)
     return jsonify({'access_token': access_token}), 200
 
+@app.route('/api/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    revoke_token(get_jwt())
+    db.session.commit()
+    
+    return jsonify({'message': 'Logged out successfully'}), 200
+
 @app.route('/api/client/files', methods=['GET'])
 @jwt_required()
 def list_files():
@@ -168,15 +278,9 @@ def list_files():
     if user.role != 'client':
         return jsonify({'message': 'Unauthorized'}), 403
     
-    files = File.query.all()
-    file_list = [{
-        'id': file.id,
-        'filename': file.original_filename,
-        'type': file.file_type,
-        'uploaded_at': file.created_at.isoformat()
-    } for file in files]
+    files = visible_files(user).with_entities(*FILE_LISTING_COLUMNS).all()
     
-    return jsonify({'files': file_list}), 200
+    return jsonify({'files': files}), 200
 
 @app.route('/api/client/download/<int:file_id>', methods=['GET'])
 @jwt_required()
@@ -187,10 +291,11 @@ def get_download_link(file_id):
     if user.role != 'client':
         return jsonify({'message': 'Unauthorized'}), 403
     
-    file = File.query.get_or_404(file_id)
+    file = visible_files(user).filter(File.id == file_id).first_or_404()
     
     # Generate encrypted download URL
-    encrypted_token = fernet.encrypt(file.download_token.encode()).decode()
+    with timed('crypto'):
+        encrypted_token = fernet.encrypt(file.download_token.encode()).decode()
     download_url = url_for('download_file', token=encrypted_token, _external=True)
     
     return jsonify({
@@ -208,14 +313,27 @@ def download_file(token):
         return jsonify({'message': 'Unauthorized'}), 403
     
     try:
-        decrypted_token = fernet.decrypt(token.encode()).decode()
-        file = File.query.filter_by(download_token=decrypted_token).first()
+        with timed('crypto'):
+            decrypted_token = fernet.decrypt(token.encode()).decode()
+        file = visible_files(user).filter(File.download_token == decrypted_token).first()
         
         if not file:
             return jsonify({'message': 'Invalid download link'}), 404
         
+        log_fields(file_id=file.id)
+        access_tracker.touch(file.id)
+        with timed('disk'):
+            recall(file)
+            file_path = local_path(file)
+        
+        # Not on this node: stream it from a peer that has it
+        if file_path is None:
+            if not cluster_enabled():
+                return jsonify({'message': 'File not available'}), 404
+            return proxy_download(file)
+        
         return send_from_directory(
-            app.config['UPLOAD_FOLDER'],
+            os.path.dirname(file_path),
             file.filename,
             as_attachment=True,
             download_name=file.original_filename
@@ -223,6 +341,74 @@ def download_file(token):
     except:
         return jsonify({'message': 'Invalid download link'}), 400
 
+@app.route('/api/client/download/archive', methods=['POST'])
+@jwt_required()
+def download_archive():
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'client':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    file_ids = data.get('file_ids')
+    
+    # bool is a subclass of int, but true/false are not file ids
+    if (not isinstance(file_ids, list) or not file_ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in file_ids)):
+        return jsonify({'message': 'file_ids must be a non-empty list of integers'}), 400
+    
+    file_ids = list(dict.fromkeys(file_ids))
+    if len(file_ids) > app.config['ARCHIVE_MAX_FILES']:
+        return jsonify({'message': f"At most {app.config['ARCHIVE_MAX_FILES']} files per archive"}), 400
+    
+    # One query for the whole batch, returned in the order requested
+    files_by_id = {file.id: file for file in visible_files(user).filter(File.id.in_(file_ids)).all()}
+    missing = [file_id for file_id in file_ids if file_id not in files_by_id]
+    if missing:
+        return jsonify({'message': 'Files not found', 'missing': missing}), 404
+    
+    log_fields(file_ids=file_ids)
+    try:
+        with timed('disk'):
+            entries = build_entries([files_by_id[file_id] for file_id in file_ids], ensure_local)
+        # Record any replicas pulled from peers
+        db.session.commit()
+    except OSError:
+        return jsonify({'message': 'File not available'}), 404
+    
+    for file_id in file_ids:
+        access_tracker.touch(file_id)
+    archive = ZipStream(entries, chunk_size=app.config['ARCHIVE_CHUNK_SIZE'])
+    # Changes whenever any file in the archive does, so a client resuming
+    # with If-Range never splices bytes from two different archives
+    version = repr([(file_id, entry.size, entry.mtime_ns) for file_id, entry in zip(file_ids, entries)])
+    etag = hashlib.sha256(version.encode()).hexdigest()[:32]
+    headers = {
+        'Content-Disposition': 'attachment; filename=files.zip',
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"'
+    }
+    
+    # Support resuming an interrupted download with a single byte range. An
+    # If-Range with another archive's ETag, or a date (we send no
+    # Last-Modified), gets the whole archive instead.
+    if_range = request.if_range
+    resumable = if_range.date is None and if_range.etag in (None, etag)
+    if request.range is not None and resumable:
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            headers['Content-Range'] = f'bytes */{archive.size}'
+            return Response(status=416, headers=headers)
+        start, stop = byte_range
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{archive.size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(archive.iter_range(start, stop), status=206,
+                        mimetype='application/zip', headers=headers, direct_passthrough=True)
+    
+    headers['Content-Length'] = str(archive.size)
+    return Response(archive, mimetype='application/zip', headers=headers, direct_passthrough=True)
+
 @app.route('/api/ops/files/delete/<int:file_id>', methods=['DELETE'])
 @jwt_required()
 def delete_file_route(file_id):
@@ -235,16 +421,103 @@ def delete_file_route(file_id):
     file = File.query.get_or_404(file_id)
     
     # Delete the physical file
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    
-    # Delete database record
+    file_path = local_path(file)
+    with timed('disk'):
+        if file_path is not None:
+            os.remove(file_path)
+    
+    # Delete database record, logging the change in the same transaction
+    release_quota(file.uploaded_by, file.size_bytes)
+    filename = file.filename
     db.session.delete(file)
+    record_event(file, 'deleted')
     db.session.commit()
     
+    if cluster_enabled():
+        replicator.delete(filename)
+    
     return jsonify({'message': 'File deleted successfully'}), 200
 
+@app.route('/api/ops/files/<int:file_id>/grants', methods=['POST', 'DELETE'])
+@jwt_required()
+def file_grants(file_id):
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    file = File.query.get_or_404(file_id)
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids', [])
+    group_ids = data.get('group_ids', [])
+    
+    if not isinstance(user_ids, list) or not isinstance(group_ids, list) \
+            or not all(isinstance(i, int) for i in user_ids + group_ids):
+        return jsonify({'message': 'user_ids and group_ids must be lists of integers'}), 400
+    
+    if request.method == 'POST':
+        error = grant_targets_error(user_ids, group_ids)
+        if error:
+            return jsonify({'message': error}), 400
+        grant(file.id, user_ids, group_ids)
+        message = 'Access granted'
+    else:
+        revoke(file.id, user_ids, group_ids)
+        message = 'Access revoked'
+    db.session.commit()
+    
+    return jsonify({'message': message}), 200
+
+@app.route('/api/ops/groups', methods=['POST'])
+@jwt_required()
+def create_group():
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    if not data.get('name'):
+        return jsonify({'message': 'Group name is required'}), 400
+    
+    if Group.query.filter_by(name=data['name']).first():
+        return jsonify({'message': 'Group already exists'}), 400
+    
+    group = Group(name=data['name'])
+    db.session.add(group)
+    db.session.commit()
+    
+    return jsonify({'id': group.id, 'name': group.name}), 201
+
+@app.route('/api/ops/groups/<int:group_id>/members', methods=['POST'])
+@app.route('/api/ops/groups/<int:group_id>/members/<int:member_id>', methods=['DELETE'])
+@jwt_required()
+def group_members(group_id, member_id=None):
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    group = Group.query.get_or_404(group_id)
+    
+    if request.method == 'DELETE':
+        remove_member(group.id, member_id)
+        db.session.commit()
+        return jsonify({'message': 'Member removed'}), 200
+    
+    data = request.get_json(silent=True) or {}
+    member = User.query.get(data.get('user_id')) if isinstance(data.get('user_id'), int) else None
+    if not member:
+        return jsonify({'message': 'User not found'}), 404
+    
+    add_member(group.id, member.id)
+    db.session.commit()
+    
+    return jsonify({'message': 'Member added'}), 201
+
 @app.route('/api/ops/files', methods=['GET'])
 @jwt_required()
 def list_files_ops():
@@ -254,16 +527,141 @@ def list_files_ops():
     if user.role != 'ops':
         return jsonify({'message': 'Unauthorized'}), 403
     
-    files = File.query.all()
-    file_list = [{
-        'id': file.id,
-        'filename': file.original_filename,
-        'type': file.file_type,
-        'uploaded_at': file.created_at.isoformat(),
-        'uploaded_by': file.uploaded_by
-    } for file in files]
+    # Tiers are per copy; report this node's
+    files = File.query.outerjoin(FileReplica, and_(
+        FileReplica.file_id == File.id,
+        FileReplica.node_id == app.config['NODE_ID']
+    )).with_entities(
+        *FILE_LISTING_COLUMNS,
+        File.uploaded_by,
+        File.size_bytes.label('size'),
+        FileReplica.storage_tier.label('tier')
+    ).all()
+    
+    return jsonify({'files': files}), 200
+
+@app.route('/api/ops/users/<int:target_id>/revoke-tokens', methods=['POST'])
+@jwt_required()
+def revoke_tokens(target_id):
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    target = User.query.get_or_404(target_id)
+    revoke_user_tokens(target.id)
+    db.session.commit()
     
-    return jsonify({'files': file_list}), 200
+    return jsonify({'message': 'Tokens revoked'}), 200
+
+@app.route('/api/ops/usage', methods=['GET'])
+@jwt_required()
+def storage_usage():
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    # Read from the maintained counters rather than summing File sizes
+    uploaders = User.query.filter_by(role='ops').all()
+    usage = [{
+        'user_id': uploader.id,
+        'email': uploader.email,
+        'used_bytes': uploader.storage_used_bytes,
+        'quota_bytes': uploader.storage_quota_bytes if uploader.storage_quota_bytes is not None
+                       else app.config['STORAGE_QUOTA_BYTES']
+    } for uploader in uploaders]
+    
+    return jsonify({'usage': usage}), 200
+
+@app.route('/api/ops/changes', methods=['GET'])
+@jwt_required()
+def list_changes():
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    args = parse_feed_args()
+    if args is None:
+        return jsonify({'message': 'Invalid since, limit or wait'}), 400
+    
+    since, limit, wait = args
+    # Long-poll: hold the request open until something happens or wait expires
+    events = wait_for_events(since, limit, wait) if wait else fetch_events(since, limit)
+    
+    return jsonify({
+        'events': events,
+        'next_offset': events[-1]['offset'] if events else since
+    }), 200
+
+@app.route('/api/ops/changes/stream', methods=['GET'])
+@jwt_required()
+def stream_changes():
+    user_id = get_jwt_identity()
+    user = User.query.get(user_id)
+    
+    if user.role != 'ops':
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    args = parse_feed_args()
+    if args is None:
+        return jsonify({'message': 'Invalid since, limit or wait'}), 400
+    
+    since, limit, wait = args
+    if 'wait' not in request.args:
+        wait = app.config['CHANGE_FEED_MAX_WAIT']
+    
+    return Response(
+        stream_with_context(stream_events(since, limit, wait)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/internal/files/<int:file_id>/replica', methods=['PUT'])
+def receive_replica(file_id):
+    if not verify_peer_request(request):
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    file = File.query.get_or_404(file_id)
+    try:
+        with timed('disk'):
+            store_replica(request.stream, file.filename, request.headers.get('X-Cluster-Content-SHA256', ''))
+    except ValueError:
+        return jsonify({'message': 'Replica does not match its signature'}), 400
+    record_replica(file.id)
+    db.session.commit()
+    
+    return jsonify({'message': 'Replica stored'}), 201
+
+@app.route('/api/internal/files/<int:file_id>/content', methods=['GET'])
+def replica_content(file_id):
+    if not verify_peer_request(request):
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    file = File.query.get_or_404(file_id)
+    file_path = local_path(file)
+    if file_path is None:
+        return jsonify({'message': 'File not available'}), 404
+    
+    return send_from_directory(os.path.dirname(file_path), file.filename)
+
+@app.route('/api/internal/replicas/<filename>', methods=['DELETE'])
+def delete_replica(filename):
+    if not verify_peer_request(request):
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    # The row is already gone, so look on both tiers
+    filename = secure_filename(filename)
+    for folder in (app.config['UPLOAD_FOLDER'], app.config['COLD_STORAGE_FOLDER']):
+        file_path = os.path.join(folder, filename)
+        if filename and os.path.exists(file_path):
+            os.remove(file_path)
+    
+    return jsonify({'message': 'Replica deleted'}), 200
 
 @app.route('/api/files/search', methods=['GET'])
 @jwt_required()
@@ -274,8 +672,8 @@ def search_files():
     query = request.args.get('q', '').lower()
     file_type = request.args.get('type')
     
-    # Base query
-    files_query = File.query
+    # Base query, restricted to the files this user can see
+    files_query = visible_files(user)
     
     # Apply search filters
     if query:
@@ -284,17 +682,10 @@ def search_files():
     if file_type:
         files_query = files_query.filter(File.file_type == file_type)
     
-    files = files_query.all()
-    
-    file_list = [{
-        'id': file.id,
-        'filename': file.original_filename,
-        'type': file.file_type,
-        'uploaded_at': file.created_at.isoformat(),
-        'uploaded_by': file.uploaded_by if user.role == 'ops' else None
-    } for file in files]
+    uploaded_by = File.uploaded_by if user.role == 'ops' else null().label('uploaded_by')
+    files = files_query.with_entities(*FILE_LISTING_COLUMNS, uploaded_by).all()
     
     return jsonify({
-        'files': file_list,
-        'total': len(file_list)
+        'files': files,
+        'total': len(files)
     }), 200 
\ No newline at end of file
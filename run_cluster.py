@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+from cryptography.fernet import Fernet
+
+# Starts several nodes on this machine, each with its own upload folder and
+# port, sharing one SQLite database, to try out cluster mode locally.
+
+def start_cluster(count, base_port=5001, workdir='cluster'):
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    
+    nodes = [(f"node-{i}", base_port + i - 1) for i in range(1, count + 1)]
+    shared_env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'cluster.db')}",
+        SECRET_KEY=os.getenv('SECRET_KEY', 'local-cluster-secret-key'),
+        DOWNLOAD_LINK_KEY=os.getenv('DOWNLOAD_LINK_KEY', Fernet.generate_key().decode()),
+        CLUSTER_SECRET=os.getenv('CLUSTER_SECRET', 'local-cluster-secret'),
+        CLUSTER_PEERS=','.join(f"{name}=http://127.0.0.1:{port}" for name, port in nodes)
+    )
+    
+    # Create the shared database once
+    subprocess.run([sys.executable, 'create_db.py'], env=shared_env, check=True)
+    
+    processes = []
+    for name, port in nodes:
+        node_dir = os.path.join(workdir, name)
+        env = dict(
+            shared_env,
+            NODE_ID=name,
+            PORT=str(port),
+            UPLOAD_FOLDER=os.path.join(node_dir, 'uploads'),
+            COLD_STORAGE_FOLDER=os.path.join(node_dir, 'uploads_cold'),
+            REVOCATION_BLOOM_FILE=os.path.join(node_dir, 'revoked_tokens.bloom'),
+            REQUEST_LOG_FILE=os.path.join(node_dir, 'requests.log')
+        )
+        processes.append(subprocess.Popen([sys.executable, 'app.py'], env=env))
+        print(f"{name} listening on http://127.0.0.1:{port}")
+    
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    # Usage: python run_cluster.py [number_of_nodes]
+    start_cluster(int(sys.argv[1]) if len(sys.argv) > 1 else 2)
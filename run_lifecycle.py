@@ -0,0 +1,52 @@
+import os
+import sys
+
+from sqlalchemy import func
+
+from app import app, db
+from models import User, File
+from storage import archive_cold_files, local_path
+from revocation import prune_revocations
+from cluster import cluster_enabled, repair_replicas, replicator
+
+def backfill_usage():
+    with app.app_context():
+        # Record sizes for files uploaded before size tracking existed
+        for file in File.query.filter_by(size_bytes=0).all():
+            path = local_path(file)
+            if path is not None:
+                file.size_bytes = os.path.getsize(path)
+        db.session.commit()
+        
+        # Rebuild the per-user counters from file sizes
+        totals = dict(db.session.query(File.uploaded_by, func.sum(File.size_bytes)).group_by(File.uploaded_by).all())
+        for user in User.query.all():
+            user.storage_used_bytes = totals.get(user.id, 0)
+        db.session.commit()
+        print("Storage usage backfilled!")
+
+def run_lifecycle():
+    with app.app_context():
+        moved = archive_cold_files()
+        print(f"Moved {moved} file(s) to {app.config['COLD_STORAGE_FOLDER']}")
+        
+        # Expired revocations no longer matter; drop them and shrink the filter
+        prune_revocations()
+        print("Expired token revocations pruned")
+        
+        if cluster_enabled():
+            queued = repair_replicas()
+            # Waits for retries too, so failures are known before we exit
+            replicator.join()
+            print(f"Pushed {queued - replicator.failed} of {queued} missing replica(s) to peers")
+            if replicator.failed:
+                return False
+        return True
+
+if __name__ == "__main__":
+    # Run from cron, e.g. nightly: python run_lifecycle.py
+    if '--backfill' in sys.argv:
+        backfill_usage()
+    
+    if not run_lifecycle():
+        sys.exit(1)
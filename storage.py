@@ -0,0 +1,222 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, case, or_, update
+
+from app import app, db
+from models import User, File, FileReplica
+from per_process import PerProcess
+
+# Storage accounting and tiering.
+#
+# Per-user usage is a counter on User updated in the same transaction as the
+# upload or delete, so quota checks never aggregate over File. Copies start
+# on the hot tier (UPLOAD_FOLDER); the lifecycle job moves cold ones to
+# COLD_STORAGE_FOLDER and downloads recall them. Each node has its own disk,
+# so the tier is tracked per copy on this node's FileReplica row, not on
+# File. Moves copy to a temporary name and rename it into place, commit the
+# new tier, then remove the old copy, so the row never points at a missing
+# file and a reader never sees a half-written one.
+
+HOT = 'hot'
+COLD = 'cold'
+
+logger = logging.getLogger('filesharing.storage')
+
+
+def tier_folder(tier):
+    return app.config['COLD_STORAGE_FOLDER'] if tier == COLD else app.config['UPLOAD_FOLDER']
+
+
+def local_replica(file):
+    """This node's FileReplica row for ``file``, or None."""
+    return db.session.get(FileReplica, (file.id, app.config['NODE_ID']))
+
+
+def _replica_path(file, replica):
+    return os.path.join(tier_folder(replica.storage_tier), file.filename)
+
+
+def local_path(file):
+    """Path of this node's copy, or None if it has none.
+
+    Looks on the recorded tier first, then the other one, in case the copy
+    predates its replica row.
+    """
+    replica = local_replica(file)
+    tier = replica.storage_tier if replica is not None else HOT
+    for tier in (tier, HOT if tier == COLD else COLD):
+        path = os.path.join(tier_folder(tier), file.filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def tier_of(path):
+    """The tier a local path returned by ``local_path`` is on."""
+    cold_folder = os.path.abspath(tier_folder(COLD))
+    return COLD if os.path.dirname(os.path.abspath(path)) == cold_folder else HOT
+
+
+def reserve_quota(user, size):
+    """Add ``size`` to the user's usage if it fits their quota.
+
+    A single conditional UPDATE, so concurrent uploads cannot overshoot.
+    Returns False when the quota would be exceeded.
+    """
+    quota = user.storage_quota_bytes
+    if quota is None:
+        quota = app.config['STORAGE_QUOTA_BYTES']
+    statement = update(User).where(User.id == user.id).values(
+        storage_used_bytes=User.storage_used_bytes + size
+    )
+    if quota is not None:
+        statement = statement.where(User.storage_used_bytes + size <= quota)
+    result = db.session.execute(statement.execution_options(synchronize_session=False))
+    return result.rowcount == 1
+
+
+def release_quota(user_id, size):
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(storage_used_bytes=case(
+            (User.storage_used_bytes > size, User.storage_used_bytes - size),
+            else_=0
+        ))
+        .execution_options(synchronize_session=False)
+    )
+
+
+class AccessTracker(PerProcess):
+    """Buffers download times and writes them in one batched UPDATE.
+
+    Each process flushes its buffer from a background thread every
+    ACCESS_FLUSH_INTERVAL and again at exit, so downloads never wait on the
+    write and an idle worker does not sit on access times the lifecycle job
+    needs to see.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending = {}
+        atexit.register(self._flush_at_exit)
+
+    def _start(self):
+        threading.Thread(target=self._run, name='access-tracker', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['ACCESS_FLUSH_INTERVAL'])
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception('Could not flush file access times')
+
+    def _flush_at_exit(self):
+        if not self.pending:
+            return
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception:
+            logger.exception('Could not flush file access times at exit')
+
+    def touch(self, file_id):
+        self.ensure_started()
+        with self.lock:
+            self.pending[file_id] = datetime.utcnow()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            db.session.execute(
+                update(File.__table__)
+                .where(File.__table__.c.id == bindparam('file_id'))
+                .values(last_accessed_at=bindparam('accessed_at')),
+                [{'file_id': file_id, 'accessed_at': accessed_at} for file_id, accessed_at in pending.items()]
+            )
+            db.session.commit()
+        except Exception:
+            # Keep the times for the next attempt, unless newer ones arrived
+            db.session.rollback()
+            with self.lock:
+                for file_id, accessed_at in pending.items():
+                    self.pending.setdefault(file_id, accessed_at)
+            raise
+
+
+access_tracker = AccessTracker()
+
+
+def _move(file, replica, tier):
+    """Move this node's copy to ``tier``; False if another process moved it first."""
+    source = _replica_path(file, replica)
+    target_folder = tier_folder(tier)
+    os.makedirs(target_folder, exist_ok=True)
+    target = os.path.join(target_folder, file.filename)
+    tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.part'
+    try:
+        shutil.copy2(source, tmp_path)
+        # Atomic, so a download already reading the target keeps its copy
+        os.replace(tmp_path, target)
+    except FileNotFoundError:
+        # The source was removed by a concurrent move of the same file
+        db.session.refresh(replica)
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    replica.storage_tier = tier
+    db.session.commit()
+    try:
+        os.remove(source)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def recall(file):
+    """Bring this node's copy back to the hot tier before serving it."""
+    replica = local_replica(file)
+    if replica is None or replica.storage_tier != COLD:
+        return
+    # Another download may have recalled it since the row was loaded
+    db.session.refresh(replica)
+    if replica.storage_tier == COLD and os.path.exists(_replica_path(file, replica)):
+        _move(file, replica, HOT)
+
+
+def archive_cold_files(now=None, batch_size=500):
+    """Move this node's copies of files not downloaded for COLD_AFTER_DAYS to the cold tier."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=app.config['COLD_AFTER_DAYS'])
+    access_tracker.flush()
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(File, FileReplica).join(FileReplica, and_(
+            FileReplica.file_id == File.id,
+            FileReplica.node_id == app.config['NODE_ID']
+        )).filter(
+            File.id > last_id,
+            FileReplica.storage_tier == HOT,
+            or_(File.last_accessed_at < cutoff,
+                File.last_accessed_at.is_(None) & (File.created_at < cutoff))
+        ).order_by(File.id).limit(batch_size).all()
+        if not rows:
+            return moved
+        last_id = rows[-1][0].id
+        for file, replica in rows:
+            if os.path.exists(_replica_path(file, replica)) and _move(file, replica, COLD):
+                moved += 1
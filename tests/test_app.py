@@ -1,14 +1,41 @@
 import pytest
 import os
 import io
+import logging
+import shutil
+import sys
+import uuid
+import time
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
+import zipfile
 from app import app, db, bcrypt
-from models import User, File
+from models import User, File, FileAccess, FileReplica, RevokedToken
+from acl import grant
+from archive import ArchiveEntry, ZipStream
+from request_log import request_logger
+import storage
+from storage import archive_cold_files, access_tracker, recall, local_path, local_replica
+import json_provider
+from bloom import BloomFilter
+from revocation import revocations, check_if_token_revoked, revoke_user_tokens
+from sqlalchemy import event, update
+from werkzeug.test import EnvironBuilder
+from werkzeug.wsgi import FileWrapper
+from cluster import Replicator, sign, signed_headers, verify_signature
 
 @pytest.fixture
-def client():
+def client(tmp_path):
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['UPLOAD_FOLDER'] = 'test_uploads'
+    # A fresh revocation filter per test, never the one in instance/
+    bloom_file = app.config['REVOCATION_BLOOM_FILE']
+    app.config['REVOCATION_BLOOM_FILE'] = str(tmp_path / 'revoked_tokens.bloom')
+    revocations.pid = None
     
     with app.test_client() as client:
         with app.app_context():
@@ -18,6 +45,9 @@ def client():
                 os.makedirs(app.config['UPLOAD_FOLDER'])
             yield client
             # Cleanup
+            access_tracker.pending.clear()
+            app.config['REVOCATION_BLOOM_FILE'] = bloom_file
+            revocations.pid = None
             db.session.remove()
             db.drop_all()
             # Remove test uploads folder
@@ -152,6 +182,8 @@ def test_get_download_link(client):
         download_token='test-token'
     )
     db.session.add(test_file)
+    db.session.flush()
+    grant(test_file.id, user_ids=[user.id])
     db.session.commit()
     
     response = client.get(
@@ -161,4 +193,644 @@ def test_get_download_link(client):
     assert response.status_code == 200
     assert 'download_link' in response.json
     assert 'message' in response.json
-    assert response.json['message'] == 'success' 
\ No newline at end of file
+    assert response.json['message'] == 'success'
+
+def create_stored_file(ops_user, name, content, shared_with=()):
+    unique_filename = f'{name}-stored'
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename), 'wb') as f:
+        f.write(content)
+    test_file = File(
+        filename=unique_filename,
+        original_filename=name,
+        file_type=name.rsplit('.', 1)[1],
+        uploaded_by=ops_user.id,
+        download_token=f'token-{unique_filename}'
+    )
+    db.session.add(test_file)
+    db.session.flush()
+    db.session.add(FileReplica(file_id=test_file.id, node_id=app.config['NODE_ID']))
+    grant(test_file.id, user_ids=shared_with)
+    db.session.commit()
+    return test_file
+
+def test_download_archive(client):
+    user = create_client_user()
+    login_response = client.post('/api/client/login', json={
+        'email': 'client@example.com',
+        'password': 'password123'
+    })
+    token = login_response.json['access_token']
+    
+    ops_user = create_ops_user()
+    first = create_stored_file(ops_user, 'report.docx', b'first' * 1000, [user.id])
+    second = create_stored_file(ops_user, 'sheet.xlsx', b'second', [user.id])
+    
+    response = client.post(
+        '/api/client/download/archive',
+        json={'file_ids': [first.id, second.id]},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    body = response.get_data()
+    assert int(response.headers['Content-Length']) == len(body)
+    
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.namelist() == ['report.docx', 'sheet.xlsx']
+        assert archive.testzip() is None
+        assert archive.read('report.docx') == b'first' * 1000
+    
+    # Resuming part way through returns the remaining bytes
+    resumed = client.post(
+        '/api/client/download/archive',
+        json={'file_ids': [first.id, second.id]},
+        headers={'Authorization': f'Bearer {token}', 'Range': 'bytes=100-'}
+    )
+    assert resumed.status_code == 206
+    assert resumed.get_data() == body[100:]
+    etag = response.headers['ETag']
+    assert resumed.headers['ETag'] == etag
+    
+    # Resuming inside the second entry or the central directory
+    for start in (len(body) - 200, len(body) - 30):
+        resumed = client.post(
+            '/api/client/download/archive',
+            json={'file_ids': [first.id, second.id]},
+            headers={'Authorization': f'Bearer {token}', 'Range': f'bytes={start}-', 'If-Range': etag}
+        )
+        assert resumed.status_code == 206
+        assert resumed.get_data() == body[start:]
+    
+    # Once a file changes, a stale If-Range gets the whole new archive
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], second.filename), 'wb') as f:
+        f.write(b'changed')
+    restarted = client.post(
+        '/api/client/download/archive',
+        json={'file_ids': [first.id, second.id]},
+        headers={'Authorization': f'Bearer {token}', 'Range': 'bytes=100-', 'If-Range': etag}
+    )
+    assert restarted.status_code == 200
+    assert restarted.headers['ETag'] != etag
+    with zipfile.ZipFile(io.BytesIO(restarted.get_data())) as archive:
+        assert archive.testzip() is None
+        assert archive.read('sheet.xlsx') == b'changed'
+
+def test_archive_range_skips_earlier_entries(tmp_path, monkeypatch):
+    paths = []
+    for index in range(3):
+        path = tmp_path / f'{index}.docx'
+        path.write_bytes(bytes([index]) * 5000)
+        paths.append(path)
+    entries = [ArchiveEntry(str(path), path.name, 5000, datetime(2024, 1, 1), path.stat().st_mtime_ns)
+               for path in paths]
+    archive = ZipStream(entries, chunk_size=1024)
+    body = b''.join(archive)
+    
+    # With the CRCs cached, a range in the last entry never opens the others
+    opened = []
+    real_read = ZipStream._read
+    def tracking_read(self, entry, start, stop):
+        opened.append(entry.name)
+        return real_read(self, entry, start, stop)
+    monkeypatch.setattr(ZipStream, '_read', tracking_read)
+    start = entries[2].offset + 100
+    assert b''.join(ZipStream(entries, chunk_size=1024).iter_range(start)) == body[start:]
+    assert opened == ['2.docx']
+
+def test_download_archive_missing_file(client):
+    create_client_user()
+    login_response = client.post('/api/client/login', json={
+        'email': 'client@example.com',
+        'password': 'password123'
+    })
+    token = login_response.json['access_token']
+    
+    response = client.post(
+        '/api/client/download/archive',
+        json={'file_ids': [42]},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 404
+    assert response.json['missing'] == [42]
+    
+    response = client.post(
+        '/api/client/download/archive',
+        json={'file_ids': [True]},
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 400
+
+def test_file_visibility_follows_grants(client):
+    user = create_client_user()
+    login_response = client.post('/api/client/login', json={
+        'email': 'client@example.com',
+        'password': 'password123'
+    })
+    token = login_response.json['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    
+    ops_user = create_ops_user()
+    ops_token = client.post('/api/ops/login', json={
+        'email': 'ops@example.com',
+        'password': 'password123'
+    }).json['access_token']
+    ops_headers = {'Authorization': f'Bearer {ops_token}'}
+    
+    shared = create_stored_file(ops_user, 'shared.docx', b'shared')
+    create_stored_file(ops_user, 'private.docx', b'private')
+    
+    assert client.get('/api/client/files', headers=headers).json['files'] == []
+    assert client.get(f'/api/client/download/{shared.id}', headers=headers).status_code == 404
+    
+    # Grant through a group, then directly, then revoke each path in turn
+    group_id = client.post('/api/ops/groups', json={'name': 'clients'}, headers=ops_headers).json['id']
+    client.post(f'/api/ops/groups/{group_id}/members', json={'user_id': user.id}, headers=ops_headers)
+    client.post(f'/api/ops/files/{shared.id}/grants', json={'group_ids': [group_id]}, headers=ops_headers)
+    client.post(f'/api/ops/files/{shared.id}/grants', json={'user_ids': [user.id]}, headers=ops_headers)
+    
+    files = client.get('/api/client/files', headers=headers).json['files']
+    assert [f['filename'] for f in files] == ['shared.docx']
+    search = client.get('/api/files/search?q=docx', headers=headers).json
+    assert search['total'] == 1
+    
+    client.delete(f'/api/ops/files/{shared.id}/grants', json={'user_ids': [user.id]}, headers=ops_headers)
+    assert FileAccess.query.count() == 1
+    
+    client.delete(f'/api/ops/groups/{group_id}/members/{user.id}', headers=ops_headers)
+    assert FileAccess.query.count() == 0
+    assert client.get('/api/client/files', headers=headers).json['files'] == []
+
+def test_change_feed(client):
+    create_ops_user()
+    token = client.post('/api/ops/login', json={
+        'email': 'ops@example.com',
+        'password': 'password123'
+    }).json['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    
+    client.post(
+        '/api/ops/upload',
+        data={'file': (io.BytesIO(b"test content"), "test.docx")},
+        headers=headers,
+        content_type='multipart/form-data'
+    )
+    file = File.query.first()
+    client.delete(f'/api/ops/files/delete/{file.id}', headers=headers)
+    
+    feed = client.get('/api/ops/changes', headers=headers).json
+    assert [e['event'] for e in feed['events']] == ['created', 'deleted']
+    assert all(e['file_id'] == file.id for e in feed['events'])
+    
+    # Resuming from an offset returns only the delta
+    first_offset = feed['events'][0]['offset']
+    delta = client.get(f'/api/ops/changes?since={first_offset}', headers=headers).json
+    assert [e['event'] for e in delta['events']] == ['deleted']
+    assert delta['next_offset'] == feed['next_offset']
+    
+    stream = client.get(
+        '/api/ops/changes/stream?wait=0',
+        headers={**headers, 'Last-Event-ID': str(first_offset)}
+    )
+    assert stream.mimetype == 'text/event-stream'
+    body = stream.get_data(as_text=True)
+    assert f"id: {feed['next_offset']}\nevent: deleted\n" in body
+    assert 'event: created' not in body
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.payloads = []
+
+    def emit(self, record):
+        self.payloads.append(record.payload)
+
+def test_request_log(client):
+    handler = CapturingHandler()
+    request_logger.addHandler(handler)
+    slow_ms = app.config['REQUEST_LOG_SLOW_MS']
+    sample_rates = app.config['REQUEST_LOG_SAMPLE_RATES']
+    try:
+        create_client_user()
+        
+        # Every request counts as slow, so the phase breakdown is attached
+        app.config['REQUEST_LOG_SLOW_MS'] = 0
+        response = client.post('/api/client/login', json={
+            'email': 'client@example.com',
+            'password': 'password123'
+        })
+        response.close()
+        payload = handler.payloads[-1]
+        assert payload['endpoint'] == 'client_login'
+        assert payload['status'] == 200
+        assert payload['slow'] is True
+        assert payload['phases_ms']['auth'] > 0
+        assert payload['phases_ms']['db'] > 0
+        
+        # Sampled-out endpoints are skipped unless slow
+        app.config['REQUEST_LOG_SLOW_MS'] = 60000
+        app.config['REQUEST_LOG_SAMPLE_RATES'] = {'home': 0.0}
+        client.get('/').close()
+        assert len(handler.payloads) == 1
+        
+        app.config['REQUEST_LOG_SAMPLE_RATES'] = {}
+        client.get('/').close()
+        assert handler.payloads[-1]['endpoint'] == 'home'
+        assert 'phases_ms' not in handler.payloads[-1]
+    finally:
+        request_logger.removeHandler(handler)
+        app.config['REQUEST_LOG_SLOW_MS'] = slow_ms
+        app.config['REQUEST_LOG_SAMPLE_RATES'] = sample_rates
+
+def test_request_log_covers_downloads(client):
+    handler = CapturingHandler()
+    request_logger.addHandler(handler)
+    slow_ms = app.config['REQUEST_LOG_SLOW_MS']
+    try:
+        user = create_client_user()
+        token = client.post('/api/client/login', json={
+            'email': 'client@example.com',
+            'password': 'password123'
+        }).json['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        stored = create_stored_file(create_ops_user(), 'logged.docx', b'logged', [user.id])
+        link = client.get(f'/api/client/download/{stored.id}', headers=headers).json['download_link']
+        download_token = link.rsplit('/', 1)[1]
+        
+        app.config['REQUEST_LOG_SLOW_MS'] = 0
+        response = client.get(link, headers=headers)
+        assert response.data == b'logged'
+        response.close()
+        payload = handler.payloads[-1]
+        assert payload['endpoint'] == 'download_file'
+        assert payload['path'] == '/api/download/<token>'
+        assert 'phases_ms' in payload
+        assert download_token not in json.dumps(payload, default=str)
+        
+        # The server's file wrapper reaches it untouched, so sendfile still applies
+        class ServerFileWrapper(FileWrapper):
+            pass
+        
+        environ = EnvironBuilder(path=link, headers=headers).get_environ()
+        environ['wsgi.file_wrapper'] = ServerFileWrapper
+        body = app.wsgi_app(environ, lambda status, response_headers: None)
+        assert isinstance(body, ServerFileWrapper)
+        assert b''.join(body) == b'logged'
+        body.close()
+        assert handler.payloads[-1]['endpoint'] == 'download_file'
+        
+        client.post(
+            '/api/client/download/archive',
+            json={'file_ids': [stored.id]},
+            headers=headers
+        ).close()
+        assert handler.payloads[-1]['endpoint'] == 'download_archive'
+    finally:
+        request_logger.removeHandler(handler)
+        app.config['REQUEST_LOG_SLOW_MS'] = slow_ms
+
+def test_upload_quota(client):
+    user = create_ops_user()
+    user.storage_quota_bytes = 20
+    db.session.commit()
+    token = client.post('/api/ops/login', json={
+        'email': 'ops@example.com',
+        'password': 'password123'
+    }).json['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    
+    def upload(content):
+        return client.post(
+            '/api/ops/upload',
+            data={'file': (io.BytesIO(content), "test.docx")},
+            headers=headers,
+            content_type='multipart/form-data'
+        )
+    
+    assert upload(b"x" * 15).status_code == 201
+    assert upload(b"x" * 10).status_code == 413
+    assert db.session.get(User, user.id).storage_used_bytes == 15
+    assert File.query.one().size_bytes == 15
+    
+    client.delete(f'/api/ops/files/delete/{File.query.one().id}', headers=headers)
+    assert db.session.get(User, user.id).storage_used_bytes == 0
+    assert upload(b"x" * 10).status_code == 201
+
+def test_cold_tier_recall(client):
+    app.config['COLD_STORAGE_FOLDER'] = 'test_uploads_cold'
+    # Drop access times buffered by earlier tests against reused file ids
+    access_tracker.pending.clear()
+    try:
+        user = create_client_user()
+        token = client.post('/api/client/login', json={
+            'email': 'client@example.com',
+            'password': 'password123'
+        }).json['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        ops_user = create_ops_user()
+        stored = create_stored_file(ops_user, 'old.docx', b'old content', [user.id])
+        stored.created_at = datetime.utcnow() - timedelta(days=app.config['COLD_AFTER_DAYS'] + 1)
+        db.session.commit()
+        
+        assert archive_cold_files() == 1
+        assert local_replica(stored).storage_tier == 'cold'
+        assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], stored.filename))
+        
+        link = client.get(f'/api/client/download/{stored.id}', headers=headers).json['download_link']
+        response = client.get(link, headers=headers)
+        assert response.status_code == 200
+        assert response.data == b'old content'
+        response.close()
+        
+        # Downloading recalled the file and its access time is flushed in a batch
+        access_tracker.flush()
+        stored = db.session.get(File, stored.id)
+        assert local_replica(stored).storage_tier == 'hot'
+        assert stored.last_accessed_at is not None
+        assert archive_cold_files() == 0
+    finally:
+        shutil.rmtree('test_uploads_cold', ignore_errors=True)
+        app.config['COLD_STORAGE_FOLDER'] = 'uploads_cold'
+
+def test_concurrent_recall(client, monkeypatch):
+    app.config['COLD_STORAGE_FOLDER'] = 'test_uploads_cold'
+    try:
+        stored = create_stored_file(create_ops_user(), 'race.docx', b'race', [])
+        stored.created_at = datetime.utcnow() - timedelta(days=app.config['COLD_AFTER_DAYS'] + 1)
+        db.session.commit()
+        assert archive_cold_files() == 1
+        hot_path = os.path.join(app.config['UPLOAD_FOLDER'], stored.filename)
+        
+        # Another worker finishes recalling the file while this one is copying it
+        def lose_race(source, target):
+            shutil.move(source, hot_path)
+            db.session.execute(update(FileReplica).where(FileReplica.file_id == stored.id).values(storage_tier='hot'))
+            db.session.commit()
+            raise FileNotFoundError(source)
+        
+        monkeypatch.setattr(storage.shutil, 'copy2', lose_race)
+        recall(stored)
+        assert local_replica(stored).storage_tier == 'hot'
+        assert local_path(stored) == hot_path
+        assert os.listdir(app.config['UPLOAD_FOLDER']) == [stored.filename]
+    finally:
+        shutil.rmtree('test_uploads_cold', ignore_errors=True)
+        app.config['COLD_STORAGE_FOLDER'] = 'uploads_cold'
+
+def test_tiers_are_per_node(client, cluster_config):
+    app.config['COLD_STORAGE_FOLDER'] = 'test_uploads_cold'
+    try:
+        stored = create_stored_file(create_ops_user(), 'shared.docx', b'shared', [])
+        stored.created_at = datetime.utcnow() - timedelta(days=app.config['COLD_AFTER_DAYS'] + 1)
+        db.session.add(FileReplica(file_id=stored.id, node_id='node-b'))
+        db.session.commit()
+        
+        # node-a tiers its copy; node-b's copy is still hot
+        assert archive_cold_files() == 1
+        tiers = {replica.node_id: replica.storage_tier for replica in stored.replicas}
+        assert tiers == {'node-a': 'cold', 'node-b': 'hot'}
+        
+        # ...and node-b tiers its own copy on its next run
+        cluster_config['NODE_ID'] = 'node-b'
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], stored.filename), 'wb') as f:
+            f.write(b'shared')
+        assert archive_cold_files() == 1
+        db.session.refresh(stored)
+        assert {replica.storage_tier for replica in stored.replicas} == {'cold'}
+    finally:
+        shutil.rmtree('test_uploads_cold', ignore_errors=True)
+        app.config['COLD_STORAGE_FOLDER'] = 'uploads_cold'
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_json_provider_serializes_rows(client, monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(json_provider, 'orjson', None)
+    elif json_provider.orjson is None:
+        pytest.skip('orjson is not installed')
+    
+    user = create_ops_user()
+    uploaded_at = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    db.session.add(File(
+        filename='a.docx', original_filename='a.docx', file_type='docx',
+        uploaded_by=user.id, download_token='a-token', created_at=uploaded_at
+    ))
+    db.session.flush()
+    db.session.add(FileReplica(file_id=1, node_id=app.config['NODE_ID']))
+    db.session.commit()
+    
+    token = client.post('/api/ops/login', json={
+        'email': 'ops@example.com',
+        'password': 'password123'
+    }).json['access_token']
+    response = client.get('/api/ops/files', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.json['files'] == [{
+        'id': 1,
+        'filename': 'a.docx',
+        'type': 'docx',
+        'uploaded_at': uploaded_at.isoformat(),
+        'uploaded_by': user.id,
+        'size': 0,
+        'tier': 'hot'
+    }]
+
+def test_logout_revokes_token(client):
+    create_client_user()
+    credentials = {'email': 'client@example.com', 'password': 'password123'}
+    token = client.post('/api/client/login', json=credentials).json['access_token']
+    other = client.post('/api/client/login', json=credentials).json['access_token']
+    
+    response = client.post('/api/logout', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    
+    assert client.get('/api/client/files', headers={'Authorization': f'Bearer {token}'}).status_code == 401
+    assert client.get('/api/client/files', headers={'Authorization': f'Bearer {other}'}).status_code == 200
+
+def test_unrevoked_token_check_skips_database(client):
+    revocations.sync(force=True)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        revoked = check_if_token_revoked({}, {'jti': str(uuid.uuid4()), 'sub': 12345, 'iat': 0})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert revoked is False
+    assert statements == []
+
+def test_revoke_user_tokens(client):
+    user = create_client_user()
+    token = client.post('/api/client/login', json={
+        'email': 'client@example.com',
+        'password': 'password123'
+    }).json['access_token']
+    
+    create_ops_user()
+    ops_token = client.post('/api/ops/login', json={
+        'email': 'ops@example.com',
+        'password': 'password123'
+    }).json['access_token']
+    
+    response = client.post(
+        f'/api/ops/users/{user.id}/revoke-tokens',
+        headers={'Authorization': f'Bearer {ops_token}'}
+    )
+    assert response.status_code == 200
+    assert client.get('/api/client/files', headers={'Authorization': f'Bearer {token}'}).status_code == 401
+    assert client.get('/api/ops/files', headers={'Authorization': f'Bearer {ops_token}'}).status_code == 200
+
+def test_bloom_lookups_survive_reopen(tmp_path):
+    bloom = BloomFilter(str(tmp_path / 'filter.bloom'), 1000, 0.01)
+    bloom.add('revoked')
+    errors = []
+    done = threading.Event()
+    
+    def check():
+        try:
+            while not done.is_set():
+                assert 'revoked' in bloom
+                bloom.add('also-revoked')
+        except Exception as e:
+            errors.append(e)
+    
+    # Switch threads as often as possible so lookups land mid-reopen
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    checker = threading.Thread(target=check)
+    checker.start()
+    try:
+        for _ in range(2000):
+            bloom.open()
+    finally:
+        done.set()
+        checker.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+
+def test_revocation_sync_tolerates_commit_order(client):
+    revocations.sync(force=True)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=1)
+    
+    # Another host commits a higher id first, then a lower one
+    db.session.add(RevokedToken(id=100, key='late-commit-high', revoked_at=now, expires_at=expires_at))
+    db.session.commit()
+    revocations.sync(force=True)
+    db.session.add(RevokedToken(id=50, key='late-commit-low', revoked_at=now - timedelta(seconds=5),
+                                expires_at=expires_at))
+    db.session.commit()
+    revocations.sync(force=True)
+    assert revocations.might_contain('late-commit-high')
+    assert revocations.might_contain('late-commit-low')
+    
+    # Revoking a user again adds a row rather than updating the old one
+    revoke_user_tokens(12345)
+    revoke_user_tokens(12345)
+    db.session.commit()
+    assert RevokedToken.query.filter_by(key='user:12345').count() == 2
+    assert check_if_token_revoked({}, {'jti': str(uuid.uuid4()), 'sub': 12345, 'iat': int(time.time()) - 60})
+
+@pytest.fixture
+def cluster_config():
+    saved = {key: app.config[key] for key in ('NODE_ID', 'CLUSTER_PEERS', 'CLUSTER_SECRET')}
+    app.config['NODE_ID'] = 'node-a'
+    app.config['CLUSTER_PEERS'] = {'node-a': 'http://127.0.0.1:1'}
+    app.config['CLUSTER_SECRET'] = 'cluster-secret'
+    yield app.config
+    app.config.update(saved)
+
+def test_download_streams_from_peer(client, cluster_config):
+    content = b'held by the other node' * 100
+    
+    class PeerHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not verify_signature('GET', self.path, self.headers):
+                self.send_response(403)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        
+        def log_message(self, *args):
+            pass
+    
+    peer = HTTPServer(('127.0.0.1', 0), PeerHandler)
+    threading.Thread(target=peer.serve_forever, daemon=True).start()
+    cluster_config['CLUSTER_PEERS'] = {
+        'node-a': 'http://127.0.0.1:1',
+        'node-b': f'http://127.0.0.1:{peer.server_port}'
+    }
+    try:
+        user = create_client_user()
+        token = client.post('/api/client/login', json={
+            'email': 'client@example.com',
+            'password': 'password123'
+        }).json['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        # The file row exists but only node-b has the bytes
+        ops_user = create_ops_user()
+        remote = File(filename='remote.docx', original_filename='remote.docx', file_type='docx',
+                      uploaded_by=ops_user.id, download_token='remote-token')
+        db.session.add(remote)
+        db.session.flush()
+        db.session.add(FileReplica(file_id=remote.id, node_id='node-b'))
+        grant(remote.id, user_ids=[user.id])
+        db.session.commit()
+        
+        link = client.get(f'/api/client/download/{remote.id}', headers=headers).json['download_link']
+        response = client.get(link, headers=headers)
+        assert response.status_code == 200
+        assert response.data == content
+        assert 'remote.docx' in response.headers['Content-Disposition']
+    finally:
+        peer.shutdown()
+        peer.server_close()
+
+def test_replicator_join_waits_for_retries(client, cluster_config, tmp_path):
+    cluster_config['CLUSTER_PEERS'] = {'node-a': 'http://127.0.0.1:1', 'node-b': 'http://127.0.0.1:1'}
+    retries = cluster_config['CLUSTER_REPLICATION_RETRIES']
+    cluster_config['CLUSTER_REPLICATION_RETRIES'] = 2
+    path = tmp_path / 'unreachable.docx'
+    path.write_bytes(b'nobody home')
+    try:
+        pending = Replicator()
+        pending.push(1, str(path))
+        pending.join()
+        # Both attempts ran before join returned, rather than the retry being dropped
+        assert pending.failed == 1
+    finally:
+        cluster_config['CLUSTER_REPLICATION_RETRIES'] = retries
+
+def test_replica_endpoints_require_signature(client, cluster_config):
+    ops_user = create_ops_user()
+    test_file = File(filename='pushed.docx', original_filename='pushed.docx', file_type='docx',
+                     uploaded_by=ops_user.id, download_token='pushed-token')
+    db.session.add(test_file)
+    db.session.commit()
+    path = f'/api/internal/files/{test_file.id}/replica'
+    
+    assert client.put(path, data=b'pushed').status_code == 403
+    
+    headers = signed_headers('PUT', path, hashlib.sha256(b'pushed').hexdigest())
+    response = client.put(path, data=b'pushed', headers=headers)
+    assert response.status_code == 201
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'pushed.docx'), 'rb') as f:
+        assert f.read() == b'pushed'
+    assert db.session.get(FileReplica, (test_file.id, 'node-a')) is not None
+    
+    # A captured signature cannot carry a different body
+    response = client.put(path, data=b'tampered', headers=headers)
+    assert response.status_code == 400
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'pushed.docx'), 'rb') as f:
+        assert f.read() == b'pushed'
+    
+    # ...or be replayed once it is stale
+    stale_at = int(headers['X-Cluster-Timestamp']) - 3600
+    stale = dict(headers, **{
+        'X-Cluster-Timestamp': str(stale_at),
+        'X-Cluster-Signature': sign('PUT', path, 'node-a', stale_at, headers['X-Cluster-Content-SHA256'])
+    })
+    assert client.put(path, data=b'pushed', headers=stale).status_code == 403